@@ -1,7 +1,11 @@
 import os
 from pathlib import Path
+from typing import Iterator
+
 from dotenv import load_dotenv
-from sqlmodel import SQLModel, create_engine, Session
+
+from sqlalchemy import event
+from sqlmodel import create_engine, Session
 
 # Определяем путь к .env файлу (он должен быть в корне проекта interior-collage)
 # db.py находится в backend/, поэтому поднимаемся на уровень выше
@@ -17,4 +21,27 @@ else:
 
 # Теперь читаем DATABASE_URL (он будет из .env или значение по умолчанию)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./products.db")
-engine = create_engine(DATABASE_URL, echo=False)
+engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+
+
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL: чтения не ждут записи; busy_timeout вместо мгновенного "database is locked"
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+def get_session() -> Iterator[Session]:
+    """Зависимость FastAPI: сессия закрывается после обработки запроса"""
+    with Session(engine) as session:
+        yield session
+
+
+def init_db() -> None:
+    # Таблицы регистрируются в metadata при импорте моделей
+    from .models import Product
+    Product.metadata.create_all(engine)
@@ -1,5 +1,4 @@
-import os
-from typing import List, Optional
+from typing import Optional
 
 from fastapi import FastAPI, Query, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
@@ -10,6 +9,7 @@ from sqlmodel import select
 # Импортируем db - он сам загрузит .env
 from .db import init_db, get_session
 from .models import Product
+from .pagination import decode_cursor, encode_cursor
 
 app = FastAPI(title="Interior Collage Builder - MVP")
 
@@ -26,16 +26,33 @@ def root():
 
 @app.get("/products")
 def get_products(
-    skip: int = 0,
-    limit: int = 10,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    after_id: Optional[int] = Query(None, description="устарело, используйте cursor"),
     name: Optional[str] = Query(None),
     session=Depends(get_session)
 ):
+    if cursor:
+        try:
+            after_id = decode_cursor(cursor)["id"]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     query = select(Product)
     if name:
         query = query.where(Product.name.contains(name))
+    # Keyset-пагинация по id; skip оставлен для старых клиентов
+    if after_id is not None:
+        query = query.where(Product.id > after_id)
+    elif skip:
+        query = query.offset(skip)
+    query = query.order_by(Product.id).limit(limit + 1)
     products = session.exec(query).all()
-    return products
+    has_more = len(products) > limit
+    products = products[:limit]
+    # Курсор в том же формате, что у /api/products в interior-collage
+    next_cursor = encode_cursor({"id": products[-1].id}) if has_more else None
+    return {"items": products, "next_cursor": next_cursor}
 
 @app.post("/products")
 def create_product(product: Product, session=Depends(get_session)):
@@ -72,18 +89,16 @@ def delete_product(product_id: int, session=Depends(get_session)):
     return Response(status_code=204)
 
 @app.get("/api/debug/db-info")
-def debug_db_info():
+def debug_db_info(session=Depends(get_session)):
     """Временный endpoint для проверки подключения к БД"""
-    import os
-    from .db import DATABASE_URL, engine
-    
-    with get_session() as session:
-        from sqlmodel import select, text
-        # Проверяем количество записей
-        count_result = session.exec(text("SELECT COUNT(*) FROM product")).first()
-        # Получаем все категории
-        categories_result = session.exec(text("SELECT DISTINCT category FROM product WHERE category IS NOT NULL")).all()
-        
+    from sqlmodel import text
+    from .db import DATABASE_URL
+
+    # Проверяем количество записей
+    count_result = session.exec(text("SELECT COUNT(*) FROM product")).scalar()
+    # Получаем все категории
+    categories_result = session.exec(text("SELECT DISTINCT category FROM product WHERE category IS NOT NULL")).scalars().all()
+
     return {
         "database_url": DATABASE_URL,
         "total_products": count_result,
@@ -2,24 +2,30 @@ import os
 import re
 import csv
 import sqlite3
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, Iterator, Optional, List, Set, Tuple
 from pathlib import Path
 import sys
 
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import Session, create_engine, delete, select, update
 
-# Import Product model when run as a script or module
+# Import the backend package when run as a script or module
 try:
-	from .models import Product  # type: ignore
+	from .models import Product, ProductImage, ProductSignature, save_product_image  # type: ignore
+	from .similar import similarity_index  # type: ignore
+	from .downloader import MAX_IMAGE_SIZE_BYTES, ConcurrentDownloader, FetchResult  # type: ignore
+	from .migrations import upgrade  # type: ignore
+	from .snapshot import write_catalog_snapshot  # type: ignore
 except Exception:
-	# Fallback: add parent folder to sys.path and import
-	CURRENT_DIR = Path(__file__).resolve().parent
-	PARENT_DIR = CURRENT_DIR
-	if str(PARENT_DIR) not in sys.path:
-		sys.path.insert(0, str(PARENT_DIR))
-	from models import Product  # type: ignore
-
-import requests
+	# Fallback: add the project folder to sys.path and import the package
+	PROJECT_DIR = Path(__file__).resolve().parents[1]
+	if str(PROJECT_DIR) not in sys.path:
+		sys.path.insert(0, str(PROJECT_DIR))
+	from backend.models import Product, ProductImage, ProductSignature, save_product_image  # type: ignore
+	from backend.similar import similarity_index  # type: ignore
+	from backend.downloader import MAX_IMAGE_SIZE_BYTES, ConcurrentDownloader, FetchResult  # type: ignore
+	from backend.migrations import upgrade  # type: ignore
+	from backend.snapshot import write_catalog_snapshot  # type: ignore
+
 import random
 
 # Unwanted category fragments (case-insensitive substring match)
@@ -37,9 +43,11 @@ EXCLUDED_CATEGORY_FRAGMENTS = {
 	"товары для ремонта",
 }
 
-MAX_IMAGE_SIZE_BYTES = int(os.getenv("MAX_IMAGE_SIZE_BYTES", str(6 * 1024 * 1024)))  # 6 MB cap
 PER_CATEGORY_LIMIT = int(os.getenv("PER_CATEGORY_LIMIT", "20"))
 TOTAL_LIMIT = int(os.getenv("TOTAL_LIMIT", "400"))  # overall cap on saved products
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))  # products per transaction
+# Incremental mode: send a conditional GET for every kept image to catch in-place changes
+REVALIDATE_IMAGES = os.getenv("REVALIDATE_IMAGES", "1") not in ("0", "false", "no")
 RANDOM_SEED = os.getenv("RANDOM_SEED")
 if RANDOM_SEED is not None:
 	try:
@@ -60,46 +68,13 @@ def has_image(url: Optional[str]) -> bool:
 	return True
 
 
-def download_image_bytes(url: str, session: Optional[requests.Session] = None) -> Optional[bytes]:
-	s = session or requests.Session()
-	try:
-		# Try a quick HEAD first to fail fast on huge payloads
-		try:
-			h = s.head(url, timeout=5, allow_redirects=True)
-			cl = h.headers.get("Content-Length")
-			if cl and int(cl) > MAX_IMAGE_SIZE_BYTES:
-				return None
-		except Exception:
-			pass  # not fatal; proceed to GET
-
-		with s.get(url, timeout=7, stream=True) as r:
-			r.raise_for_status()
-			content_type = (r.headers.get("Content-Type") or "").lower()
-
-			# Accept common cases even when servers mislabel images
-			looks_like_image = any(url.lower().endswith(ext) for ext in [".jpg", ".jpeg", ".png", ".webp", ".gif"])
-			if ("image" not in content_type) and ("octet-stream" not in content_type) and not looks_like_image:
-				return None
-
-			buf = bytearray()
-			for chunk in r.iter_content(chunk_size=8192):
-				if not chunk:
-					break
-				buf.extend(chunk)
-				if len(buf) > MAX_IMAGE_SIZE_BYTES:
-					return None
-			return bytes(buf) if buf else None
-	except Exception:
-		return None
-
-
 def extract_id_from_url(url: str) -> Optional[str]:
 	match = re.search(r"/(\d+)/?$", url.strip())
 	return match.group(1) if match else None
 
 
-def read_csv_products(csv_path: Path) -> Dict[str, Dict[str, Optional[str]]]:
-	products: Dict[str, Dict[str, Optional[str]]] = {}
+def iter_csv_products(csv_path: Path) -> Iterator[Tuple[str, Dict[str, Optional[str]]]]:
+	"""Streams (offer_id, {name, brand, image_url}) rows from the CSV export"""
 	with csv_path.open("r", encoding="utf-8", newline="") as f:
 		reader = csv.DictReader(f, delimiter=";")
 		# Normalize headers (strip quotes/spaces)
@@ -116,106 +91,160 @@ def read_csv_products(csv_path: Path) -> Dict[str, Dict[str, Optional[str]]]:
 			image_url = clean.get("Изображение") or ""
 			if not name:
 				continue
-			products[pid] = {
+			yield pid, {
 				"name": name,
 				"brand": brand,
 				"image_url": image_url or None,
 			}
-	return products
+
+
+COLOR_PARAM_NAMES = {"цвет", "color", "color name"}
+MAX_REPORTED_XML_ERRORS = 10
+
+
+def _local_tag(elem) -> str:
+	# "{namespace}offer" -> "offer"
+	return elem.tag.rsplit("}", 1)[-1].lower()
 
 
 def try_parse_xml(xml_path: Path) -> Dict[str, Dict[str, Optional[str]]]:
-	"""Best-effort streaming parse of common YML/XML (categories/offers).
+	"""Best-effort single-pass streaming parse of common YML/XML (categories/offers).
 	Returns map: offer_id -> {category, color}
+
+	Every finished <offer>/<category> is detached from its parent right away, so memory stays
+	flat on huge exports. Category ids are resolved to names after the pass, so their order in
+	the file does not matter. Malformed offers are counted and reported instead of aborting.
 	"""
-	from xml.etree.ElementTree import iterparse
+	from xml.etree.ElementTree import ParseError, iterparse
 
-	result: Dict[str, Dict[str, Optional[str]]] = {}
 	category_by_id: Dict[str, str] = {}
-
-	# First pass: categories (if present)
+	offers: Dict[str, Tuple[Optional[str], Optional[str]]] = {}  # offer_id -> (category_id, color)
+	errors: List[str] = []
+	malformed = 0
+	offers_seen = 0
+
+	def report(message: str) -> None:
+		if len(errors) < MAX_REPORTED_XML_ERRORS:
+			errors.append(message)
+
+	stack = []  # open elements; stack[-1] is the parent of the element being closed
+	current_offer_id: Optional[str] = None
+	current_category_id: Optional[str] = None
+	current_color: Optional[str] = None
 	try:
 		for event, elem in iterparse(xml_path, events=("start", "end")):
-			if event == "end" and elem.tag.lower().endswith("category"):
+			if event == "start":
+				stack.append(elem)
+				if _local_tag(elem) == "offer":
+					current_offer_id = (elem.get("id") or "").strip() or None
+					current_category_id = None
+					current_color = None
+				continue
+
+			stack.pop()
+			tag = _local_tag(elem)
+			if tag == "categoryid":
+				current_category_id = (elem.text or "").strip() or None
+			elif tag == "param":
+				# Looking for color param (common: name="Цвет")
+				param_name = (elem.get("name") or elem.get("Name") or "").strip().lower()
+				if param_name in COLOR_PARAM_NAMES:
+					current_color = (elem.text or "").strip() or current_color
+			elif tag == "category":
 				cat_id = elem.get("id")
 				name = (elem.text or "").strip()
 				if cat_id and name:
 					category_by_id[cat_id] = name
-				# Free memory
-				elem.clear()
-	except Exception:
-		# XML may be too big or different format; we'll just skip
-		pass
-
-	# Second pass: offers
-	try:
-		current_offer_id: Optional[str] = None
-		current_category_id: Optional[str] = None
-		current_color: Optional[str] = None
-		for event, elem in iterparse(xml_path, events=("start", "end")):
-			tag = elem.tag.lower()
-			if event == "start" and tag.endswith("offer"):
-				current_offer_id = elem.get("id") or None
-				current_category_id = None
-				current_color = None
-			elif event == "end":
-				if tag.endswith("categoryid"):
-					text = (elem.text or "").strip()
-					if text:
-						current_category_id = text
-				elif tag.endswith("param"):
-					# Looking for color param (common: name="Цвет")
-					param_name = (elem.get("name") or elem.get("Name") or "").strip().lower()
-					if param_name in {"цвет", "color", "color name"}:
-						val = (elem.text or "").strip()
-						if val:
-							current_color = val
-				elif tag.endswith("offer"):
-					if current_offer_id:
-						category = category_by_id.get(current_category_id or "", None)
-						result[current_offer_id] = {"category": category, "color": current_color}
-					# Clear and reset
-					elem.clear()
-					current_offer_id = None
-					current_category_id = None
-					current_color = None
-	except Exception:
-		# Best-effort only
-		pass
-
+			elif tag == "offer":
+				offers_seen += 1
+				if current_offer_id:
+					offers[current_offer_id] = (current_category_id, current_color)
+				else:
+					malformed += 1
+					report(f"offer #{offers_seen} has no id")
+				current_offer_id = None
+			else:
+				continue
+			# Drop the finished subtree so the tree never grows with the document
+			elem.clear()
+			if stack:
+				stack[-1].remove(elem)
+	except ParseError as e:
+		# Keep everything parsed up to the broken spot
+		report(f"XML parse error, stopped at {e.position}: {e}")
+	except OSError as e:
+		report(f"cannot read {xml_path}: {e}")
+
+	missing_category = 0
+	result: Dict[str, Dict[str, Optional[str]]] = {}
+	for offer_id, (category_id, color) in offers.items():
+		category = category_by_id.get(category_id or "")
+		if category_id and category is None:
+			missing_category += 1
+		result[offer_id] = {"category": category, "color": color}
+
+	if malformed or missing_category or errors:
+		print(
+			f"[XML] {xml_path.name}: offers={len(result)}, malformed={malformed}, "
+			f"unknown_category_id={missing_category}"
+		)
+		for message in errors:
+			print(f"[XML]   {message}")
 	return result
 
 
 def ensure_db_schema(db_path: Path) -> Session:
 	engine = create_engine(f"sqlite:///{db_path}", echo=False)
-	SQLModel.metadata.create_all(engine)
+	# Creates/upgrades tables and installs the triggers that keep the search index
+	# and facet counters in sync with every write
+	upgrade(engine)
 	return Session(engine)
 
 
-def build_catalog(shared_dir: Path, out_db: Path) -> None:
-	csv_file = shared_dir / "Экспорт раздела Весь каталог.csv"
-	xml_file = shared_dir / "Экспорт раздела Весь каталог.xml"
-
-	csv_map = read_csv_products(csv_file)
-	xml_map: Dict[str, Dict[str, Optional[str]]] = {}
-	if xml_file.exists():
-		xml_map = try_parse_xml(xml_file)
-
-	# Prepare output DB
-	if out_db.exists():
-		out_db.unlink()
-	session = ensure_db_schema(out_db)
+def backfill_offer_ids(session: Session, csv_path: Path) -> int:
+	"""Fills offer_id on rows written before it existed, matching them to the CSV by (name, image_url).
 
-	# Insert products
-	seen_names = set()
-	candidates_by_category: Dict[str, List[Dict[str, Optional[str]]]] = {}
-	skipped_no_category = 0
-	skipped_excluded_category = 0
-	skipped_no_image_url = 0
-	for pid, data in csv_map.items():
+	Rows that match no offer were added by hand (API, import_excel): they are not catalog offers,
+	so an incremental run leaves them alone. Returns how many rows got an offer_id.
+	"""
+	rows = session.exec(
+		select(Product.id, Product.name, Product.image_url).where(Product.offer_id.is_(None))
+	).all()
+	if not rows:
+		return 0
+	legacy = {(name, image_url): product_id for product_id, name, image_url in rows}
+	taken = set(session.exec(select(Product.offer_id).where(Product.offer_id.is_not(None))).all())
+	matched = 0
+	for pid, data in iter_csv_products(csv_path):
+		if pid in taken:
+			continue
+		product_id = legacy.pop((data.get("name") or "", data.get("image_url") or ""), None)
+		if product_id is None:
+			continue
+		taken.add(pid)
+		session.get(Product, product_id).offer_id = pid
+		matched += 1
+		if not legacy:
+			break
+	session.commit()
+	session.expunge_all()
+	print(f"[DB] Backfilled offer_id on {matched} legacy products, {len(rows) - matched} not from the catalog")
+	return matched
+
+
+def filter_candidates(
+	rows: Iterable[Tuple[str, Dict[str, Optional[str]]]],
+	xml_map: Dict[str, Dict[str, Optional[str]]],
+	stats: Dict[str, int],
+) -> Iterator[Dict[str, Optional[str]]]:
+	"""Applies the filter rules and yields offers that may be sampled"""
+	seen_ids: Set[str] = set()
+	seen_names: Set[str] = set()
+	for pid, data in rows:
 		name = data.get("name") or ""
-		if name in seen_names:
+		if pid in seen_ids or name in seen_names:
 			continue
+		seen_ids.add(pid)
 		seen_names.add(name)
 
 		x = xml_map.get(pid, {})
@@ -225,66 +254,294 @@ def build_catalog(shared_dir: Path, out_db: Path) -> None:
 
 		# Filter rules before sampling
 		if not category:
-			skipped_no_category += 1
+			stats["no_category"] += 1
 			continue
 		if any(excl in category.lower() for excl in EXCLUDED_CATEGORY_FRAGMENTS):
-			skipped_excluded_category += 1
+			stats["excluded_category"] += 1
 			continue
 		if not has_image(image_url):
-			skipped_no_image_url += 1
+			stats["no_image_url"] += 1
 			continue
 
-		candidates_by_category.setdefault(category, []).append({
+		yield {
+			"offer_id": pid,
 			"name": name,
 			"category": category,
 			"color": color,
 			"image_url": image_url,
-		})
+		}
+
 
-	# Random sampling per category
-	selected: List[Dict[str, Optional[str]]] = []
-	for cat, items in candidates_by_category.items():
-		if len(items) <= PER_CATEGORY_LIMIT:
-			selected.extend(items)
+class CategorySampler:
+	"""Per-category reservoir sampling: keeps at most `limit` offers per category in memory,
+	each one equally likely to survive, however long the stream is.
+
+	Offers from `keep` (already in the DB) are preferred, so an incremental run does not
+	reshuffle the catalog every day.
+	"""
+
+	def __init__(self, limit: int, keep: Optional[Set[str]] = None) -> None:
+		self.limit = limit
+		self.keep = keep or set()
+		self._kept: Dict[str, List[Dict[str, Optional[str]]]] = {}
+		self._reservoir: Dict[str, List[Dict[str, Optional[str]]]] = {}
+		self._seen: Dict[str, int] = {}
+
+	def add(self, item: Dict[str, Optional[str]]) -> None:
+		category = item["category"] or ""
+		if item["offer_id"] in self.keep:
+			kept = self._kept.setdefault(category, [])
+			if len(kept) < self.limit:
+				kept.append(item)
+				return
+		reservoir = self._reservoir.setdefault(category, [])
+		seen = self._seen.get(category, 0) + 1
+		self._seen[category] = seen
+		if len(reservoir) < self.limit:
+			reservoir.append(item)
 		else:
-			selected.extend(random.sample(items, PER_CATEGORY_LIMIT))
+			j = random.randrange(seen)
+			if j < self.limit:
+				reservoir[j] = item
+
+	def sample(self) -> List[Dict[str, Optional[str]]]:
+		selected: List[Dict[str, Optional[str]]] = []
+		for category in dict.fromkeys([*self._kept, *self._reservoir]):
+			kept = self._kept.get(category, [])
+			selected.extend(kept)
+			# Any subset of a uniform reservoir is still a uniform sample
+			selected.extend(self._reservoir.get(category, [])[:self.limit - len(kept)])
+		return selected
+
+
+def sample_candidates(
+	candidates: Iterable[Dict[str, Optional[str]]],
+	keep: Optional[Set[str]] = None,
+) -> List[Dict[str, Optional[str]]]:
+	"""Random sampling of at most PER_CATEGORY_LIMIT offers per category"""
+	sampler = CategorySampler(PER_CATEGORY_LIMIT, keep)
+	for item in candidates:
+		sampler.add(item)
+	return sampler.sample()
+
+
+def new_product(item: Dict[str, Optional[str]], result: FetchResult) -> Product:
+	return Product(
+		name=item["name"] or "",
+		category=item["category"],
+		image_url=item["image_url"] or "",
+		color=item["color"],
+		tags=None,
+		offer_id=item["offer_id"],
+		image_source_etag=result.etag,
+		image_source_modified=result.last_modified,
+	)
 
-	# Download and insert only selected
-	to_add: List[Product] = []
-	download_failed = 0
-	req_session = requests.Session()
+
+class BatchWriter:
+	"""Buffers downloaded products and writes them `batch_size` at a time.
+
+	Each batch is added, flushed and committed in one short transaction, so the write lock
+	is never held while the next images are still downloading. Small batches keep at most
+	one batch of image blobs in memory and let readers see the catalog grow during the build.
+	"""
+
+	def __init__(self, session: Session, batch_size: int = WRITE_BATCH_SIZE) -> None:
+		self.session = session
+		self.batch_size = max(1, batch_size)
+		self.pending: List[Tuple[Dict[str, Optional[str]], FetchResult]] = []
+		self.saved = 0
+
+	def add(self, item: Dict[str, Optional[str]], result: FetchResult) -> None:
+		self.pending.append((item, result))
+		self.saved += 1
+		if len(self.pending) >= self.batch_size:
+			self.flush()
+
+	def flush(self) -> None:
+		if not self.pending:
+			return
+		products = [new_product(item, result) for item, result in self.pending]
+		self.session.add_all(products)
+		self.session.flush()  # assigns product ids for the image rows
+		for product, (_, result) in zip(products, self.pending):
+			save_product_image(self.session, product.id, result.data or b"")
+		self.session.commit()
+		# Drop committed objects (and their blobs) from the identity map
+		self.session.expunge_all()
+		self.pending = []
+
+
+def download_new(
+	downloader: ConcurrentDownloader,
+	items: List[Dict[str, Optional[str]]],
+	limit: int,
+	writer: BatchWriter,
+) -> None:
+	"""Downloads images concurrently and hands each one to the writer as soon as it arrives;
+	stops as soon as `limit` products are saved"""
+	if limit <= 0:
+		return
+	downloads = downloader.map(items, lambda item: item["image_url"] or "", total=len(items))
+	try:
+		for item, result in downloads:
+			if not result.data:
+				continue
+			writer.add(item, result)
+			if writer.saved >= limit:
+				break
+	finally:
+		downloads.close()
+		writer.flush()
+
+
+def sync_existing(
+	session: Session,
+	downloader: ConcurrentDownloader,
+	selected: List[Dict[str, Optional[str]]],
+	existing: Dict[str, Product],
+	stats: Dict[str, int],
+) -> None:
+	"""Incremental mode: deletes offers that are gone, updates changed metadata and
+	re-fetches an image only if its URL changed or a conditional GET says it changed."""
+	selected_ids = {item["offer_id"] for item in selected}
+
+	gone_ids = [p.id for offer_id, p in existing.items() if offer_id not in selected_ids]
+	for chunk_start in range(0, len(gone_ids), 500):
+		chunk = gone_ids[chunk_start:chunk_start + 500]
+		session.exec(delete(ProductImage).where(ProductImage.product_id.in_(chunk)))
+		session.exec(delete(ProductSignature).where(ProductSignature.product_id.in_(chunk)))
+		session.exec(delete(Product).where(Product.id.in_(chunk)))
+	session.commit()
+	for product_id in gone_ids:
+		similarity_index.discard(product_id)
+	stats["deleted"] = len(gone_ids)
+
+	# Plain tuples for the download threads: read before the commit expires the rows
+	jobs: List[Tuple[Dict[str, Optional[str]], int, Optional[Tuple[Optional[str], Optional[str]]]]] = []
 	for item in selected:
-		if len(to_add) >= TOTAL_LIMIT:
-			break
-		image_bytes = download_image_bytes(item["image_url"] or "", session=req_session)
-		if not image_bytes:
-			download_failed += 1
+		product = existing.get(item["offer_id"] or "")
+		if product is None:
 			continue
-		product = Product(
-			name=item["name"] or "",
-			category=item["category"],
-			image_url=item["image_url"] or "",
-			image_blob=image_bytes,
-			color=item["color"],
-			tags=None,
-		)
-		to_add.append(product)
-
-	# Bulk save
-	for chunk_start in range(0, len(to_add), 1000):
-		chunk = to_add[chunk_start:chunk_start + 1000]
-		session.add_all(chunk)
+		changed = False
+		for field in ("name", "category", "color"):
+			if getattr(product, field) != item[field]:
+				setattr(product, field, item[field])
+				changed = True
+		url_changed = product.image_url != item["image_url"]
+		if url_changed:
+			product.image_url = item["image_url"] or ""
+			changed = True
+		if changed:
+			session.add(product)
+			stats["updated"] += 1
+		if url_changed or REVALIDATE_IMAGES:
+			validators = None if url_changed else (product.image_source_etag, product.image_source_modified)
+			jobs.append((item, product.id, validators))
+	session.commit()
+	session.expunge_all()
+
+	ready: List[Tuple[int, FetchResult]] = []
+
+	def write_ready() -> None:
+		# Same short transactions as BatchWriter: the write lock is not held while downloading
+		for product_id, result in ready:
+			save_product_image(session, product_id, result.data or b"")
+			session.exec(
+				update(Product)
+				.where(Product.id == product_id)
+				.values(image_source_etag=result.etag, image_source_modified=result.last_modified)
+			)
 		session.commit()
+		session.expunge_all()
+		ready.clear()
+
+	downloads = downloader.map(jobs, lambda job: job[0]["image_url"] or "", len(jobs), lambda job: job[2])
+	try:
+		for (_, product_id, _), result in downloads:
+			if result.not_modified:
+				continue
+			if not result.data:
+				continue  # keep the old image; it will be retried next run
+			ready.append((product_id, result))
+			stats["images_refetched"] += 1
+			if len(ready) >= WRITE_BATCH_SIZE:
+				write_ready()
+	finally:
+		downloads.close()
+		write_ready()
+
+
+def build_catalog(shared_dir: Path, out_db: Path, incremental: bool = False) -> None:
+	csv_file = shared_dir / "Экспорт раздела Весь каталог.csv"
+	xml_file = shared_dir / "Экспорт раздела Весь каталог.xml"
+
+	xml_map: Dict[str, Dict[str, Optional[str]]] = {}
+	if xml_file.exists():
+		xml_map = try_parse_xml(xml_file)
+
+	# Prepare output DB: a full build starts from scratch, an incremental one updates it in place
+	if out_db.exists() and not incremental:
+		out_db.unlink()
+	session = ensure_db_schema(out_db)
+	if incremental:
+		backfill_offer_ids(session, csv_file)
+
+	stats = {
+		"no_category": 0, "excluded_category": 0, "no_image_url": 0,
+		"updated": 0, "deleted": 0, "images_refetched": 0,
+	}
+	existing: Dict[str, Product] = {}
+	if incremental:
+		existing = {p.offer_id: p for p in session.exec(select(Product).where(Product.offer_id.is_not(None))).all()}
+
+	# parse -> filter -> sample: generators, so only the per-category reservoirs stay in memory
+	candidates = filter_candidates(iter_csv_products(csv_file), xml_map, stats)
+	selected = sample_candidates(candidates, keep=set(existing))
+	revalidator = ConcurrentDownloader(max_bytes=MAX_IMAGE_SIZE_BYTES, label="revalidate")
+	if incremental:
+		sync_existing(session, revalidator, selected, existing, stats)
+
+	# Download and insert only selected offers that are not in the DB yet
+	new_items = [item for item in selected if item["offer_id"] not in existing]
+	if incremental:
+		# Hand-added rows (no offer_id) own their (name, image_url); don't collide with them
+		taken_keys = set(
+			session.exec(select(Product.name, Product.image_url).where(Product.offer_id.is_(None))).all()
+		)
+		new_items = [item for item in new_items if (item["name"], item["image_url"]) not in taken_keys]
+	kept = len(selected) - len(new_items)
+	downloader = ConcurrentDownloader(max_bytes=MAX_IMAGE_SIZE_BYTES)
+	writer = BatchWriter(session)
+	download_new(downloader, new_items, TOTAL_LIMIT - kept, writer)
+	session.close()
+	# Prebuilt compressed catalog for /api/catalog/snapshot, so the first request doesn't build it
+	write_catalog_snapshot(session.get_bind())
 
 	print(
-		f"Saved {len(to_add)} products to {out_db}. "
-		f"Skipped: no_category={skipped_no_category}, excluded_category={skipped_excluded_category}, "
-		f"no_image_url={skipped_no_image_url}, download_failed={download_failed}."
+		f"Saved {writer.saved} new products to {out_db}. "
+		f"Skipped: no_category={stats['no_category']}, excluded_category={stats['excluded_category']}, "
+		f"no_image_url={stats['no_image_url']}, download_failed={downloader.failed}."
 	)
+	if incremental:
+		print(
+			f"Incremental: kept={kept}, updated={stats['updated']}, deleted={stats['deleted']}, "
+			f"images_refetched={stats['images_refetched']}, images_unchanged={revalidator.not_modified}."
+		)
 
 
 if __name__ == "__main__":
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Build catalog.db from the shared CSV/XML export")
+	parser.add_argument(
+		"--incremental",
+		action="store_true",
+		help="update the existing catalog.db in place instead of rebuilding it from scratch",
+	)
+	args = parser.parse_args()
+
 	root = Path(__file__).resolve().parents[1]
 	shared = root / "shared"
 	out = shared / "catalog.db"
-	build_catalog(shared, out)
+	build_catalog(shared, out, incremental=args.incremental)
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class DiskLRUCache:
+    """Ограниченный по размеру кэш файлов на диске с вытеснением давно не использованных (LRU).
+
+    Порядок использования хранится в памяти процесса; после перезапуска
+    он восстанавливается по времени изменения файлов.
+    Если задан ttl_seconds, записи старше этого срока (по времени записи файла) считаются промахом.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, ttl_seconds: Optional[float] = None) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # имя файла -> размер
+        self._total = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _filename(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        # Вызывается под self._lock
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total += size
+        self._loaded = True
+
+    def get(self, key: str) -> Optional[Path]:
+        """Возвращает путь к закэшированному файлу или None."""
+        name = self._filename(key)
+        path = self.directory / name
+        with self._lock:
+            self._load()
+            if name not in self._index:
+                return None
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                self._total -= self._index.pop(name)
+                return None
+            if self.ttl_seconds is not None and time.time() - mtime > self.ttl_seconds:
+                self._total -= self._index.pop(name)
+                path.unlink(missing_ok=True)
+                return None
+            self._index.move_to_end(name)
+        return path
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Содержимое записи или None. Байты уже в памяти, поэтому вытеснение файла
+        после возврата ответу не мешает."""
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            # Вытеснили между get и чтением — считаем промахом
+            with self._lock:
+                size = self._index.pop(path.name, None)
+                if size is not None:
+                    self._total -= size
+            return None
+
+    def temp_path(self) -> Path:
+        """Путь для временного файла в папке кэша (чтобы put_file был атомарным переименованием)"""
+        with self._lock:
+            self._load()
+        return self.directory / f"{uuid.uuid4().hex}.tmp"
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Атомарно записывает данные в кэш и вытесняет старые записи при переполнении."""
+        tmp = self.temp_path()
+        tmp.write_bytes(data)
+        return self.put_file(key, tmp)
+
+    def put_file(self, key: str, tmp_path: Path) -> Path:
+        """Переносит готовый файл из temp_path() в кэш."""
+        name = self._filename(key)
+        path = self.directory / name
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+        with self._lock:
+            if name in self._index:
+                self._total -= self._index.pop(name)
+            self._index[name] = size
+            self._total += size
+            self._evict()
+        return path
+
+    def _evict(self) -> None:
+        # Вызывается под self._lock; самую свежую запись не трогаем
+        while self._total > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                (self.directory / name).unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,228 @@
+"""
+Хранение коллажей: снимок + правки.
+
+Снимок (collage.elements_json) — список элементов на версии base_version, JSON сжат zlib.
+Каждое автосохранение редактора — одна маленькая строка collage_delta с операциями
+add/move/transform/delete, снимок при этом не переписывается. Когда правок после снимка
+накопится COLLAGE_COMPACT_AFTER, фоновая задача сворачивает их в новый снимок.
+
+Версия коллажа растёт на 1 с каждой правкой; клиент присылает версию, на которой
+основаны его операции, и получает 409, если кто-то успел сохранить раньше.
+"""
+
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Literal, Optional
+
+from pydantic import BaseModel, Field, model_validator
+from sqlmodel import Session, delete, select, update
+
+from .db import engine
+from .models import Collage, CollageDelta, utcnow
+
+COLLAGE_COMPACT_AFTER = int(os.getenv("COLLAGE_COMPACT_AFTER", "50"))
+COLLAGE_MAX_OPS = 1000
+SNAPSHOT_COMPRESS_LEVEL = 6
+
+
+class CollageOp(BaseModel):
+    """Одна операция над элементом коллажа (id элемента назначает редактор)"""
+    op: Literal["add", "move", "transform", "delete"]
+    id: str = Field(min_length=1)
+    element: Optional[Dict[str, Any]] = None  # add: все атрибуты элемента
+    x: Optional[float] = None  # move
+    y: Optional[float] = None
+    attrs: Optional[Dict[str, Any]] = None  # transform: rotation, scale_x, scale_y, width, height, z, corners, ...
+
+    @model_validator(mode="after")
+    def _check_payload(self) -> "CollageOp":
+        if self.op == "add" and self.element is None:
+            raise ValueError("add requires element")
+        if self.op == "move" and (self.x is None or self.y is None):
+            raise ValueError("move requires x and y")
+        if self.op == "transform" and not self.attrs:
+            raise ValueError("transform requires attrs")
+        return self
+
+    def compact(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_none=True)
+
+
+class CollageCreate(BaseModel):
+    title: str = ""
+    user_id: Optional[str] = None
+    elements: List[Dict[str, Any]] = Field(default_factory=list)  # у каждого элемента есть строковый "id"
+
+    @model_validator(mode="after")
+    def _check_ids(self) -> "CollageCreate":
+        ids = [e.get("id") for e in self.elements]
+        if not all(isinstance(i, str) and i for i in ids):
+            raise ValueError("every element needs a string id")
+        if len(set(ids)) != len(ids):
+            raise ValueError("element ids must be unique")
+        return self
+
+
+class CollagePatch(BaseModel):
+    base_version: int  # версия, которую видел клиент перед этими правками
+    ops: List[CollageOp] = Field(default_factory=list, max_length=COLLAGE_MAX_OPS)
+    title: Optional[str] = None
+
+
+class CollageSummary(BaseModel):
+    id: int
+    user_id: Optional[str] = None
+    title: str
+    version: int
+    created_at: datetime
+    updated_at: datetime
+
+
+class CollageResponse(CollageSummary):
+    elements: List[Dict[str, Any]]
+
+
+class VersionConflict(Exception):
+    def __init__(self, current: int):
+        super().__init__(f"Collage was changed: current version is {current}")
+        self.current = current
+
+
+# --- Снимки и правки ---
+
+def pack_elements(elements: Dict[str, Dict[str, Any]]) -> bytes:
+    raw = json.dumps(list(elements.values()), separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(raw.encode("utf-8"), SNAPSHOT_COMPRESS_LEVEL)
+
+
+def unpack_elements(blob: bytes) -> Dict[str, Dict[str, Any]]:
+    """Снимок -> {id: элемент}; порядок словаря — порядок элементов в коллаже"""
+    if not blob:
+        return {}
+    return {e["id"]: e for e in json.loads(zlib.decompress(blob))}
+
+
+def apply_ops(elements: Dict[str, Dict[str, Any]], ops: Iterable[Dict[str, Any]]) -> None:
+    """Применяет операции на месте. Операции над уже удалёнными элементами пропускаются:
+    так правки двух вкладок не ломают друг другу коллаж"""
+    for op in ops:
+        element_id = op["id"]
+        kind = op["op"]
+        if kind == "add":
+            elements[element_id] = {**op["element"], "id": element_id}
+        elif kind == "delete":
+            elements.pop(element_id, None)
+        elif element_id in elements:
+            target = elements[element_id]
+            if kind == "move":
+                target["x"], target["y"] = op["x"], op["y"]
+            elif kind == "transform":
+                target.update({k: v for k, v in op["attrs"].items() if k != "id"})
+
+
+def _deltas_after(session: Session, collage_id: int, base_version: int, up_to: Optional[int] = None):
+    stmt = select(CollageDelta.version, CollageDelta.ops).where(
+        CollageDelta.collage_id == collage_id, CollageDelta.version > base_version
+    )
+    if up_to is not None:
+        stmt = stmt.where(CollageDelta.version <= up_to)
+    return session.exec(stmt.order_by(CollageDelta.version)).all()
+
+
+def load_elements(session: Session, collage: Collage) -> Dict[str, Dict[str, Any]]:
+    """Текущее состояние коллажа: снимок + правки после него"""
+    elements = unpack_elements(collage.elements_json)
+    for _, ops in _deltas_after(session, collage.id, collage.base_version, collage.version):
+        apply_ops(elements, json.loads(ops))
+    return elements
+
+
+def create_collage(session: Session, data: CollageCreate) -> Collage:
+    elements = {e["id"]: e for e in data.elements}
+    collage = Collage(title=data.title, user_id=data.user_id, elements_json=pack_elements(elements))
+    session.add(collage)
+    return collage
+
+
+def append_ops(session: Session, collage_id: int, patch: CollagePatch) -> int:
+    """Записывает правку и возвращает новую версию (коммит — на вызывающей стороне).
+
+    Пишутся только строка правки и заголовок коллажа; VersionConflict, если base_version устарела.
+    """
+    values: Dict[str, Any] = {"version": Collage.version + 1, "updated_at": utcnow()}
+    if patch.title is not None:
+        values["title"] = patch.title
+    # Условный UPDATE — оптимистическая блокировка: из двух одновременных сохранений пройдёт одно
+    bumped = session.exec(
+        update(Collage)
+        .where(Collage.id == collage_id, Collage.version == patch.base_version)
+        .values(**values)
+    ).rowcount
+    if not bumped:
+        current = session.exec(select(Collage.version).where(Collage.id == collage_id)).first()
+        if current is None:
+            raise LookupError(collage_id)
+        raise VersionConflict(current)
+    version = patch.base_version + 1
+    ops = json.dumps([op.compact() for op in patch.ops], separators=(",", ":"), ensure_ascii=False)
+    session.add(CollageDelta(collage_id=collage_id, version=version, ops=ops))
+    return version
+
+
+def needs_compaction(session: Session, collage_id: int) -> bool:
+    row = session.exec(select(Collage.version, Collage.base_version).where(Collage.id == collage_id)).first()
+    return row is not None and row[0] - row[1] >= COLLAGE_COMPACT_AFTER
+
+
+def delete_collage(session: Session, collage_id: int) -> bool:
+    collage = session.get(Collage, collage_id)
+    if collage is None:
+        return False
+    # Правки удаляем явно: в SQLite внешние ключи по умолчанию не проверяются
+    session.exec(delete(CollageDelta).where(CollageDelta.collage_id == collage_id))
+    session.delete(collage)
+    return True
+
+
+# --- Сворачивание правок в снимок ---
+
+_compacting: set = set()
+_compacting_lock = threading.Lock()
+
+
+def compact_collage(collage_id: int) -> bool:
+    """Сворачивает правки в новый снимок и удаляет их. Безопасна параллельно с сохранениями:
+    правки, пришедшие во время сборки, остаются поверх нового снимка"""
+    with _compacting_lock:
+        if collage_id in _compacting:
+            return False
+        _compacting.add(collage_id)
+    try:
+        with Session(engine) as session:
+            collage = session.get(Collage, collage_id)
+            if collage is None or collage.version == collage.base_version:
+                return False
+            old_base, new_base = collage.base_version, collage.version
+            elements = unpack_elements(collage.elements_json)
+            for _, ops in _deltas_after(session, collage_id, old_base, new_base):
+                apply_ops(elements, json.loads(ops))
+
+            replaced = session.exec(
+                update(Collage)
+                .where(Collage.id == collage_id, Collage.base_version == old_base)
+                .values(elements_json=pack_elements(elements), base_version=new_base)
+            ).rowcount
+            if not replaced:
+                session.rollback()
+                return False
+            session.exec(
+                delete(CollageDelta).where(CollageDelta.collage_id == collage_id, CollageDelta.version <= new_base)
+            )
+            session.commit()
+            return True
+    finally:
+        with _compacting_lock:
+            _compacting.discard(collage_id)
@@ -1,7 +1,24 @@
+"""
+Два движка: engine — для записи, read_engine — только для чтения.
+
+SQLite (файл): журнал WAL, читатели не ждут писателя и друг друга. Пишущее соединение одно
+на процесс и открывает транзакции через BEGIN IMMEDIATE — одновременные записи встают
+в очередь пула (а между процессами — в busy_timeout), а не падают с "database is locked"
+при повышении читающей транзакции до пишущей. Читающих соединений DB_READ_POOL_SIZE,
+они с query_only, случайная запись через них — ошибка.
+
+Postgres: пул DB_POOL_SIZE + DB_MAX_OVERFLOW с проверкой соединений перед выдачей;
+DATABASE_READ_URL может указывать на реплику.
+"""
+
 import os
 from pathlib import Path
+from typing import Iterator
+
 from dotenv import load_dotenv
-from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlmodel import create_engine, Session
 
 # Определяем путь к .env файлу (он должен быть в корне проекта interior-collage)
 # db.py находится в backend/, поэтому поднимаемся на уровень выше
@@ -17,16 +34,113 @@ else:
 
 # Теперь читаем DATABASE_URL (он будет из .env или значение по умолчанию)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./products.db")
+# Отдельная база для чтения (реплика Postgres); по умолчанию — та же
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or DATABASE_URL
 print(f"[DB] Подключение к базе данных: {DATABASE_URL}")  # Временный вывод для отладки
-engine = create_engine(DATABASE_URL, echo=False)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))  # на соединение
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # в WAL NORMAL не ломает базу при сбое
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def _sqlite_engine(url: str, read_only: bool) -> Engine:
+    sqlite_engine = create_engine(
+        url,
+        echo=False,
+        connect_args={"check_same_thread": False},
+        pool_size=DB_READ_POOL_SIZE if read_only else 1,
+        max_overflow=0,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record) -> None:
+        # BEGIN выдаём сами (_on_begin), драйвер sqlite3 не должен вставлять свой
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")  # сохраняется в файле базы
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _on_begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+    return sqlite_engine
+
+
+def _postgres_engine(url: str) -> Engine:
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+def create_db_engine(url: str, read_only: bool = False) -> Engine:
+    if is_sqlite_file(url):
+        return _sqlite_engine(url, read_only)
+    if make_url(url).get_backend_name() == "postgresql":
+        return _postgres_engine(url)
+    return create_engine(url, echo=False)
+
+
+engine = create_db_engine(DATABASE_URL)
+if is_sqlite_file(DATABASE_READ_URL) or DATABASE_READ_URL != DATABASE_URL:
+    read_engine = create_db_engine(DATABASE_READ_URL, read_only=True)
+else:
+    read_engine = engine  # Postgres без реплики, :memory: — общий пул
 
 
 def get_session() -> Session:
     return Session(engine)
 
 
-def init_db() -> None:
-    from .models import Product  # noqa: F401
-    SQLModel.metadata.create_all(engine)
+def get_read_session() -> Session:
+    return Session(read_engine)
 
 
+def session_dependency() -> Iterator[Session]:
+    """Depends() для эндпоинтов, которые пишут: сессия закрывается после обработчика"""
+    with Session(engine) as session:
+        yield session
+
+
+def read_session_dependency() -> Iterator[Session]:
+    with Session(read_engine) as session:
+        yield session
+
+
+def dispose_engines() -> None:
+    """Для дочерних процессов: соединения родителя не используем, открываем свои"""
+    engine.dispose(close=False)
+    if read_engine is not engine:
+        read_engine.dispose(close=False)
+
+
+def init_db() -> None:
+    from .migrations import upgrade  # импортирует модели, create_all — внутри upgrade
+    upgrade(engine)
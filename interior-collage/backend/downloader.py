@@ -0,0 +1,239 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Set, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+T = TypeVar("T")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Size cap for downloaded images, shared by build_catalog, import_excel and export_jpg_to_at1
+MAX_IMAGE_SIZE_BYTES = int(os.getenv("MAX_IMAGE_SIZE_BYTES", str(6 * 1024 * 1024)))  # 6 MB cap
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "8"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", "0.5"))  # seconds, doubled on every retry
+
+
+class FetchResult(NamedTuple):
+	"""Outcome of one download; etag/last_modified are the server validators for the next conditional GET"""
+	data: Optional[bytes]
+	etag: Optional[str] = None
+	last_modified: Optional[str] = None
+	not_modified: bool = False
+
+
+Validators = Tuple[Optional[str], Optional[str]]  # (ETag, Last-Modified) from the previous download
+
+
+class RetryableError(Exception):
+	"""Transient failure (network error, 429, 5xx) worth another attempt"""
+
+	def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+		super().__init__(message)
+		self.retry_after = retry_after
+
+
+class ConcurrentDownloader:
+	"""Thread-pool image downloader with global and per-host concurrency limits.
+
+	Every worker thread keeps its own requests.Session, so connections to a host are reused.
+	Failed or rejected downloads (too big, not an image) return None.
+	"""
+
+	def __init__(
+		self,
+		max_bytes: int,
+		workers: int = DOWNLOAD_WORKERS,
+		per_host: int = DOWNLOAD_PER_HOST,
+		retries: int = DOWNLOAD_RETRIES,
+		backoff: float = DOWNLOAD_BACKOFF,
+		connect_timeout: float = 5.0,
+		read_timeout: float = 7.0,
+		progress_every: float = 5.0,
+		label: str = "download",
+	) -> None:
+		self.max_bytes = max_bytes
+		self.workers = max(1, workers)
+		self.per_host = max(1, per_host)
+		self.retries = max(0, retries)
+		self.backoff = backoff
+		self.timeout = (connect_timeout, read_timeout)
+		self.progress_every = progress_every
+		self.label = label
+		self._local = threading.local()
+		self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+		self._host_lock = threading.Lock()
+		self._stats_lock = threading.Lock()
+		self.ok = 0
+		self.not_modified = 0
+		self.failed = 0
+		self.bytes = 0
+
+	def _session(self) -> requests.Session:
+		s = getattr(self._local, "session", None)
+		if s is None:
+			s = requests.Session()
+			adapter = HTTPAdapter(pool_connections=self.per_host, pool_maxsize=self.per_host)
+			s.mount("http://", adapter)
+			s.mount("https://", adapter)
+			self._local.session = s
+		return s
+
+	def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+		host = urlsplit(url).netloc.lower()
+		with self._host_lock:
+			slot = self._host_slots.get(host)
+			if slot is None:
+				slot = threading.BoundedSemaphore(self.per_host)
+				self._host_slots[host] = slot
+			return slot
+
+	def _download_once(self, url: str, validators: Optional[Validators] = None) -> FetchResult:
+		headers: Dict[str, str] = {}
+		if validators:
+			etag, last_modified = validators
+			if etag:
+				headers["If-None-Match"] = etag
+			if last_modified:
+				headers["If-Modified-Since"] = last_modified
+		try:
+			r = self._session().get(url, timeout=self.timeout, stream=True, headers=headers)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			raise RetryableError(str(e)) from e
+		with r:
+			if r.status_code in RETRY_STATUSES:
+				retry_after = r.headers.get("Retry-After")
+				raise RetryableError(
+					f"HTTP {r.status_code}",
+					retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+				)
+			etag = r.headers.get("ETag")
+			last_modified = r.headers.get("Last-Modified")
+			if r.status_code == 304 and headers:
+				return FetchResult(None, etag or headers.get("If-None-Match"), last_modified or headers.get("If-Modified-Since"), True)
+			r.raise_for_status()
+
+			# Size cap: Content-Length of the GET answer replaces the old extra HEAD round-trip
+			cl = r.headers.get("Content-Length")
+			if cl and cl.isdigit() and int(cl) > self.max_bytes:
+				return FetchResult(None)
+
+			content_type = (r.headers.get("Content-Type") or "").lower()
+			# Accept common cases even when servers mislabel images
+			looks_like_image = url.lower().endswith(IMAGE_EXTENSIONS)
+			if ("image" not in content_type) and ("octet-stream" not in content_type) and not looks_like_image:
+				return FetchResult(None)
+
+			buf = bytearray()
+			try:
+				for chunk in r.iter_content(chunk_size=64 * 1024):
+					if not chunk:
+						break
+					buf.extend(chunk)
+					if len(buf) > self.max_bytes:
+						return FetchResult(None)
+			except (requests.ConnectionError, requests.Timeout) as e:
+				raise RetryableError(str(e)) from e
+			return FetchResult(bytes(buf) if buf else None, etag, last_modified)
+
+	def fetch_result(self, url: str, validators: Optional[Validators] = None) -> FetchResult:
+		"""Downloads one image with retries and backoff.
+
+		With validators a conditional GET is sent; an unchanged image comes back as not_modified.
+		"""
+		slot = self._host_slot(url)
+		for attempt in range(self.retries + 1):
+			try:
+				with slot:
+					return self._download_once(url, validators)
+			except RetryableError as e:
+				if attempt >= self.retries:
+					return FetchResult(None)
+				delay = e.retry_after if e.retry_after is not None else self.backoff * (2 ** attempt)
+				time.sleep(min(delay, 30.0) + random.uniform(0, self.backoff))
+			except Exception:
+				return FetchResult(None)
+		return FetchResult(None)
+
+	def fetch(self, url: str) -> Optional[bytes]:
+		"""Downloads one image; None when it is unavailable or rejected"""
+		return self.fetch_result(url).data
+
+	def _record(self, result: FetchResult) -> None:
+		with self._stats_lock:
+			if result.data:
+				self.ok += 1
+				self.bytes += len(result.data)
+			elif result.not_modified:
+				self.not_modified += 1
+			else:
+				self.failed += 1
+
+	def map(
+		self,
+		items: Iterable[T],
+		url_of: Callable[[T], str],
+		total: Optional[int] = None,
+		validators_of: Optional[Callable[[T], Optional[Validators]]] = None,
+	) -> Iterator[Tuple[T, FetchResult]]:
+		"""Downloads items concurrently and yields (item, FetchResult) as they complete.
+
+		At most workers * 2 downloads are in flight, so memory stays bounded; breaking out of
+		the loop cancels everything that has not started yet.
+		"""
+		started = time.monotonic()
+		last_report = started
+		it = iter(items)
+		pending: Set[Future] = set()
+		future_item: Dict[Future, T] = {}
+		pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.label)
+
+		def submit_next() -> bool:
+			try:
+				item = next(it)
+			except StopIteration:
+				return False
+			validators = validators_of(item) if validators_of else None
+			fut = pool.submit(self.fetch_result, url_of(item), validators)
+			future_item[fut] = item
+			pending.add(fut)
+			return True
+
+		try:
+			while len(pending) < self.workers * 2 and submit_next():
+				pass
+			while pending:
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+				for fut in done:
+					pending.discard(fut)
+					item = future_item.pop(fut)
+					result = fut.result()
+					self._record(result)
+					submit_next()
+					yield item, result
+				now = time.monotonic()
+				if now - last_report >= self.progress_every:
+					last_report = now
+					self.report(started, total)
+		finally:
+			for fut in pending:
+				fut.cancel()
+			pool.shutdown(wait=True, cancel_futures=True)
+			self.report(started, total)
+
+	def report(self, started: float, total: Optional[int] = None) -> None:
+		elapsed = max(time.monotonic() - started, 1e-6)
+		done = self.ok + self.not_modified + self.failed
+		of_total = f"/{total}" if total is not None else ""
+		print(
+			f"[{self.label}] {done}{of_total} ok={self.ok} not_modified={self.not_modified} failed={self.failed} "
+			f"{self.bytes / elapsed / 1024 / 1024:.2f} MB/s {done / elapsed:.1f} img/s"
+		)
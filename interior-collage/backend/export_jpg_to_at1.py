@@ -1,48 +1,69 @@
+import io
 import os
 import sqlite3
 import shutil
 import sys
 from pathlib import Path
-from typing import Iterable, Tuple
+from typing import Iterator, Optional, Tuple
 
 try:
-    import httpx  # type: ignore
+    from PIL import Image  # type: ignore
 except Exception:
-    httpx = None
+    Image = None
+
+try:
+    from .downloader import MAX_IMAGE_SIZE_BYTES, ConcurrentDownloader  # type: ignore
+    from .models import ORIGINAL_VARIANT  # type: ignore
+except Exception:
+    # Запуск как скрипта: добавляем папку проекта в sys.path
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from backend.downloader import MAX_IMAGE_SIZE_BYTES, ConcurrentDownloader  # type: ignore
+    from backend.models import ORIGINAL_VARIANT  # type: ignore
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DB_PATH = PROJECT_ROOT / "products.db"
 # Целевая папка на уровне корня проекта Sobirator: /.../Sobirator/@1
 TARGET_DIR = Path(PROJECT_ROOT.parents[0]) / "@1"
+JPEG_QUALITY = 90
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
 
 
 def ensure_target_dir() -> None:
     TARGET_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def fetch_rows(conn: sqlite3.Connection) -> Iterable[Tuple[int, str]]:
+def fetch_rows(conn: sqlite3.Connection) -> Iterator[Tuple[int, str, bool]]:
+    """(id, image_url, есть ли картинка в product_image) — строки читаются по одной, без fetchall"""
     cur = conn.cursor()
     # Таблица называется "product" по умолчанию у SQLModel
-    cur.execute("SELECT id, image_url FROM product WHERE image_url IS NOT NULL AND image_url != ''")
-    for row in cur.fetchall():
+    cur.execute(
+        "SELECT p.id, COALESCE(p.image_url, ''), i.product_id IS NOT NULL FROM product AS p "
+        "LEFT JOIN product_image AS i ON i.product_id = p.id AND i.variant = ? "
+        "ORDER BY p.id",
+        (ORIGINAL_VARIANT,),
+    )
+    for row in cur:
         try:
-            _id = int(row[0])
-            url = str(row[1])
+            yield int(row[0]), str(row[1]), bool(row[2])
         except Exception:
             continue
-        low = url.lower()
-        if low.endswith(".jpg") or low.endswith(".jpeg"):
-            yield _id, url
+
+
+def load_blob(conn: sqlite3.Connection, product_id: int) -> Optional[bytes]:
+    row = conn.execute(
+        "SELECT blob FROM product_image WHERE product_id = ? AND variant = ?",
+        (product_id, ORIGINAL_VARIANT),
+    ).fetchone()
+    return bytes(row[0]) if row and row[0] else None
 
 
 def safe_filename(product_id: int, source_path: str) -> str:
-    # Имя файла: <id>_<basename>
+    # Имя файла: <id>_<basename>.jpg (для png/webp/gif расширение меняется — файл будет сконвертирован)
     base = os.path.basename(source_path.split("?")[0].split("#")[0]) or f"{product_id}.jpg"
-    # Страхуем расширение
-    low = base.lower()
-    if not (low.endswith(".jpg") or low.endswith(".jpeg")):
-        base = f"{base}.jpg"
+    stem, ext = os.path.splitext(base)
+    if ext.lower() not in JPEG_EXTENSIONS:
+        base = f"{stem or product_id}.jpg"
     return f"{product_id}_" + base
 
 
@@ -50,34 +71,50 @@ def is_http(url: str) -> bool:
     return url.startswith("http://") or url.startswith("https://")
 
 
-def download_to(path: Path, url: str) -> bool:
-    if httpx is None:
-        print("[WARN] httpx не установлен — пропускаю загрузку по URL")
-        return False
+def to_jpeg(data: bytes) -> bytes:
+    """JPEG оставляем как есть, остальное (PNG, WebP, GIF, ...) перекодируем"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return data
+    if Image is None:
+        raise RuntimeError("Pillow не установлен — не могу сконвертировать в JPEG")
+    with Image.open(io.BytesIO(data)) as img:
+        img.seek(0)  # у GIF берём первый кадр
+        if img.mode in ("RGBA", "LA", "P"):
+            # JPEG не умеет прозрачность — кладём на белый фон
+            rgba = img.convert("RGBA")
+            rgb = Image.new("RGB", rgba.size, (255, 255, 255))
+            rgb.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            rgb = img.convert("RGB")
+        out = io.BytesIO()
+        rgb.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def write_jpeg(path: Path, data: bytes) -> bool:
+    """Пишет через временный файл, чтобы оборванная запись не выглядела как готовый экспорт"""
     try:
-        # Жёсткий таймаут, чтобы не зависать на медленных ресурсах
-        with httpx.Client(follow_redirects=True, timeout=15.0) as client:
-            r = client.get(url)
-            if r.status_code == 200 and r.content:
-                path.write_bytes(r.content)
-                return True
-            print(f"[WARN] HTTP {r.status_code} при загрузке: {url}")
+        tmp = path.with_name(path.name + ".part")
+        tmp.write_bytes(to_jpeg(data))
+        os.replace(tmp, path)
+        return True
     except Exception as e:
-        print(f"[WARN] Ошибка загрузки {url}: {e}")
+        print(f"[WARN] Не удалось записать {path.name}: {e}")
         return False
-    return False
 
 
 def copy_local_to(path: Path, src: str) -> bool:
     try:
         src_path = Path(src)
-        if src_path.is_file():
+        if not src_path.is_file():
+            return False
+        if src_path.suffix.lower() in JPEG_EXTENSIONS:
             shutil.copy2(src_path, path)
             return True
+        return write_jpeg(path, src_path.read_bytes())
     except Exception as e:
         print(f"[WARN] Не удалось скопировать {src} -> {path}: {e}")
         return False
-    return False
 
 
 def main() -> int:
@@ -93,46 +130,59 @@ def main() -> int:
     max_items = int(max_items_env) if (max_items_env and max_items_env.isdigit()) else None
 
     conn = sqlite3.connect(str(DB_PATH))
-    exported = 0
-    skipped = 0
-    processed = 0
-    try:
-        for product_id, img_url in fetch_rows(conn):
-            processed += 1
-            if max_items is not None and processed > max_items:
+    stats = {"exported": 0, "skipped": 0, "failed": 0, "processed": 0}
+
+    def report(ok: bool, out_name: str) -> None:
+        if ok:
+            print(f"[OK]  {out_name}")
+            stats["exported"] += 1
+        else:
+            print(f"[ERR] {out_name}")
+            stats["failed"] += 1
+
+    def downloads_needed() -> Iterator[Tuple[Path, str]]:
+        """Обходит товары; всё, что можно записать сразу (BLOB из базы, локальный файл), пишет здесь,
+        а по сети отдаёт загрузчику — он вытягивает строки по мере освобождения потоков"""
+        for product_id, img_url, has_blob in fetch_rows(conn):
+            stats["processed"] += 1
+            if max_items is not None and stats["processed"] > max_items:
                 print(f"[INFO] Достигнут лимит EXPORT_MAX={max_items}")
-                break
+                return
 
-            out_name = safe_filename(product_id, img_url)
+            out_name = safe_filename(product_id, img_url or f"{product_id}.jpg")
             out_path = TARGET_DIR / out_name
             if out_path.exists():
-                print(f"[SKIP] Уже есть: {out_name}")
-                skipped += 1
+                stats["skipped"] += 1
                 continue
 
-            ok = False
-            if is_http(img_url):
-                print(f"[{processed}] HTTP → {img_url}", flush=True)
-                ok = download_to(out_path, img_url)
-            else:
+            blob = load_blob(conn, product_id) if has_blob else None
+            if blob:
+                report(write_jpeg(out_path, blob), out_name)
+            elif is_http(img_url):
+                yield out_path, img_url
+            elif img_url:
                 # пробуем относительный путь от корня проекта и абсолютный
                 rel_candidate = (PROJECT_ROOT / img_url).as_posix()
-                ok = copy_local_to(out_path, rel_candidate) or copy_local_to(out_path, img_url)
+                report(copy_local_to(out_path, rel_candidate) or copy_local_to(out_path, img_url), out_name)
+            else:
+                stats["skipped"] += 1
 
-            if ok:
-                print(f"[OK]  {out_name}")
-                exported += 1
+    downloader = ConcurrentDownloader(max_bytes=MAX_IMAGE_SIZE_BYTES, label="export")
+    try:
+        for (out_path, img_url), result in downloader.map(downloads_needed(), lambda job: job[1]):
+            if result.data:
+                report(write_jpeg(out_path, result.data), out_path.name)
             else:
-                print(f"[ERR] {out_name}")
-                skipped += 1
+                print(f"[WARN] Не удалось скачать: {img_url}")
+                report(False, out_path.name)
     finally:
         conn.close()
 
-    print(f"Готово. Успешно: {exported}, пропущено: {skipped}")
+    print(
+        f"Готово. Успешно: {stats['exported']}, уже были: {stats['skipped']}, ошибок: {stats['failed']}"
+    )
     return 0
 
 
 if __name__ == "__main__":
     sys.exit(main())
-
-
@@ -0,0 +1,236 @@
+"""
+Материализованные счётчики фасетов (категория -> количество, цвет -> количество)
+и номер версии каталога.
+
+Счётчики ведут триггеры на таблице product, поэтому их обновляет любая запись:
+create/update/delete из API, import_excel, build_catalog и прямой SQL.
+В SQLite триггеры построчные; в Postgres — на весь оператор, с таблицами переходов
+(REFERENCING OLD/NEW TABLE), чтобы массовая вставка меняла счётчики один раз, а не на каждую строку.
+catalog_meta.version растёт при каждом изменении product — по нему
+процесс понимает, что закэшированные фасеты устарели.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, text
+
+FACETS = ("category", "color")
+
+_DDL = [
+    """CREATE TABLE IF NOT EXISTS product_facet (
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (facet, value)
+    )""",
+    """CREATE TABLE IF NOT EXISTS catalog_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""",
+]
+
+
+def _increment(facet: str, ref: str) -> str:
+    return (
+        f"INSERT INTO product_facet(facet, value, count) SELECT '{facet}', {ref}.{facet}, 1 "
+        f"WHERE {ref}.{facet} IS NOT NULL AND {ref}.{facet} != '' "
+        f"ON CONFLICT(facet, value) DO UPDATE SET count = product_facet.count + 1;"
+    )
+
+
+def _decrement(facet: str, ref: str) -> str:
+    return f"UPDATE product_facet SET count = count - 1 WHERE facet = '{facet}' AND value = {ref}.{facet};"
+
+
+_BUMP_VERSION = "UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';"
+_DROP_EMPTY = "DELETE FROM product_facet WHERE count <= 0;"
+
+_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS product_facet_ai AFTER INSERT ON product BEGIN
+        {' '.join(_increment(f, 'new') for f in FACETS)}
+        UPDATE catalog_meta SET value = value + 1 WHERE key = 'product_count';
+        {_BUMP_VERSION}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_facet_ad AFTER DELETE ON product BEGIN
+        {' '.join(_decrement(f, 'old') for f in FACETS)}
+        {_DROP_EMPTY}
+        UPDATE catalog_meta SET value = value - 1 WHERE key = 'product_count';
+        {_BUMP_VERSION}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_facet_au AFTER UPDATE OF {', '.join(FACETS)} ON product BEGIN
+        {' '.join(_decrement(f, 'old') for f in FACETS)}
+        {' '.join(_increment(f, 'new') for f in FACETS)}
+        {_DROP_EMPTY}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_version_au AFTER UPDATE ON product BEGIN
+        {_BUMP_VERSION}
+    END""",
+]
+
+
+def _pg_delta(sources: List[tuple]) -> str:
+    """Изменение счётчиков по таблицам переходов: (таблица, знак) -> одна вставка на оператор"""
+    parts = []
+    for facet in FACETS:
+        for table, sign in sources:
+            parts.append(
+                f"SELECT '{facet}' AS facet, {facet} AS value, {sign} AS delta FROM {table} "
+                f"WHERE {facet} IS NOT NULL AND {facet} != ''"
+            )
+    return (
+        f"INSERT INTO product_facet(facet, value, count) "
+        f"SELECT facet, value, SUM(delta) FROM ({' UNION ALL '.join(parts)}) AS changes "
+        f"GROUP BY facet, value HAVING SUM(delta) != 0 "
+        f"ON CONFLICT(facet, value) DO UPDATE SET count = product_facet.count + excluded.count;"
+    )
+
+
+def _pg_function(name: str, body: str, guard: str) -> str:
+    return f"""CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM {guard}) THEN
+            {body}
+            {_BUMP_VERSION}
+        END IF;
+        RETURN NULL;
+    END $$"""
+
+
+_PG_FUNCTIONS = [
+    _pg_function(
+        "product_facet_ai",
+        f"""{_pg_delta([("new_rows", 1)])}
+            UPDATE catalog_meta SET value = value + (SELECT COUNT(*) FROM new_rows) WHERE key = 'product_count';""",
+        "new_rows",
+    ),
+    _pg_function(
+        "product_facet_ad",
+        f"""{_pg_delta([("old_rows", -1)])}
+            {_DROP_EMPTY}
+            UPDATE catalog_meta SET value = value - (SELECT COUNT(*) FROM old_rows) WHERE key = 'product_count';""",
+        "old_rows",
+    ),
+    _pg_function(
+        "product_facet_au",
+        f"""{_pg_delta([("old_rows", -1), ("new_rows", 1)])}
+            {_DROP_EMPTY}""",
+        "new_rows",
+    ),
+]
+
+_PG_TRIGGERS = [
+    "CREATE TRIGGER product_facet_ai AFTER INSERT ON product "
+    "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION product_facet_ai()",
+    "CREATE TRIGGER product_facet_ad AFTER DELETE ON product "
+    "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION product_facet_ad()",
+    "CREATE TRIGGER product_facet_au AFTER UPDATE ON product "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION product_facet_au()",
+]
+
+
+def facets_supported(engine: Engine) -> bool:
+    return engine.dialect.name in ("sqlite", "postgresql")
+
+
+def ensure_facets(engine: Engine) -> None:
+    """Создаёт таблицы и триггеры фасетов; если триггеров ещё не было — пересчитывает счётчики"""
+    if not facets_supported(engine):
+        return
+    postgres = engine.dialect.name == "postgresql"
+    with engine.begin() as conn:
+        if postgres:
+            installed = conn.exec_driver_sql(
+                "SELECT 1 FROM pg_trigger WHERE tgname = 'product_facet_ai' AND NOT tgisinternal"
+            ).first()
+            for ddl in _DDL + _PG_FUNCTIONS:
+                conn.exec_driver_sql(ddl)
+            # CREATE TRIGGER берёт эксклюзивную блокировку product — только при первой установке
+            if not installed:
+                for ddl in _PG_TRIGGERS:
+                    conn.exec_driver_sql(ddl)
+        else:
+            installed = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'product_facet_ai'"
+            ).first()
+            for ddl in _DDL + _TRIGGERS:
+                conn.exec_driver_sql(ddl)
+        if not installed:
+            rebuild_facets(conn)
+
+
+def rebuild_facets(conn) -> None:
+    """Пересчитывает счётчики с нуля (после записи в обход триггеров)"""
+    conn.exec_driver_sql("DELETE FROM product_facet")
+    for facet in FACETS:
+        conn.exec_driver_sql(
+            f"INSERT INTO product_facet(facet, value, count) "
+            f"SELECT '{facet}', {facet}, COUNT(*) FROM product "
+            f"WHERE {facet} IS NOT NULL AND {facet} != '' GROUP BY {facet}"
+        )
+    conn.exec_driver_sql(
+        "INSERT INTO catalog_meta(key, value) SELECT 'product_count', COUNT(*) FROM product "
+        "WHERE true ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO catalog_meta(key, value) VALUES ('version', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = catalog_meta.value + 1"
+    )
+
+
+def catalog_version(session: Session) -> Optional[int]:
+    """Номер версии каталога — одно чтение по первичному ключу"""
+    return session.exec(text("SELECT value FROM catalog_meta WHERE key = 'version'")).scalar()
+
+
+def _load_facets(session: Session) -> Dict[str, Any]:
+    data: Dict[str, Any] = {facet: {} for facet in FACETS}
+    if facets_supported(session.get_bind()):
+        rows = session.exec(text("SELECT facet, value, count FROM product_facet")).all()
+        total = session.exec(text("SELECT value FROM catalog_meta WHERE key = 'product_count'")).scalar()
+    else:
+        # Без триггеров (другие СУБД) считаем на лету
+        rows = []
+        for facet in FACETS:
+            rows.extend(
+                (facet, value, count)
+                for value, count in session.exec(
+                    text(
+                        f"SELECT {facet}, COUNT(*) FROM product "
+                        f"WHERE {facet} IS NOT NULL AND {facet} != '' GROUP BY {facet}"
+                    )
+                ).all()
+            )
+        total = session.exec(text("SELECT COUNT(*) FROM product")).scalar()
+    for facet, value, count in rows:
+        data.setdefault(facet, {})[value] = count
+    data["total"] = total or 0
+    return data
+
+
+class FacetCache:
+    """Кэш фасетов в памяти процесса; перечитывается, только когда изменилась версия каталога"""
+
+    def __init__(self) -> None:
+        self._version: Optional[int] = None
+        self._data: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def get(self, session: Session) -> Dict[str, Any]:
+        if not facets_supported(session.get_bind()):
+            return {"version": None, **_load_facets(session)}
+        version = catalog_version(session)
+        with self._lock:
+            if self._data is not None and version == self._version:
+                return self._data
+        data = {"version": version, **_load_facets(session)}
+        with self._lock:
+            self._version, self._data = version, data
+        return data
+
+    def categories(self, session: Session) -> List[str]:
+        return sorted(self.get(session)["category"])
+
+
+facet_cache = FacetCache()
@@ -0,0 +1,119 @@
+"""
+Загрузка картинок с чужих сайтов для API: один общий пул соединений (httpx.AsyncClient),
+ограничение размера ответа и объединение одновременных запросов к одному адресу.
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import httpx  # type: ignore
+except Exception:  # pragma: no cover
+    httpx = None  # будет установлен через зависимости
+
+MAX_REMOTE_IMAGE_BYTES = int(os.getenv("MAX_REMOTE_IMAGE_BYTES", str(6 * 1024 * 1024)))  # 6 MB cap
+REMOTE_TIMEOUT = float(os.getenv("REMOTE_TIMEOUT", "10"))
+REMOTE_MAX_CONNECTIONS = int(os.getenv("REMOTE_MAX_CONNECTIONS", "50"))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+CHUNK_SIZE = 64 * 1024
+
+_client: Optional["httpx.AsyncClient"] = None
+
+
+class RemoteFetchError(Exception):
+    """Удалённый ресурс не получен; status_code — что ответить клиенту"""
+
+    def __init__(self, message: str, status_code: int = 502) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_client() -> "httpx.AsyncClient":
+    """Общий клиент с пулом keep-alive соединений (создаётся при первом обращении)"""
+    global _client
+    if httpx is None:
+        raise RemoteFetchError("httpx not installed", status_code=500)
+    if _client is None:
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=REMOTE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=REMOTE_MAX_CONNECTIONS,
+                max_keepalive_connections=REMOTE_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def is_http_url(url: str) -> bool:
+    return url.startswith("http://") or url.startswith("https://")
+
+
+class SingleFlight:
+    """Одновременные вызовы с одним ключом ждут одну и ту же задачу вместо повторной работы"""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: если клиент оборвал соединение, загрузка для остальных продолжается
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: "asyncio.Task[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # чтобы asyncio не ругался на необработанную ошибку
+
+
+async def stream_image(url: str, write: Callable[[bytes], None], max_bytes: int = MAX_REMOTE_IMAGE_BYTES) -> str:
+    """Скачивает картинку по кускам, передавая их в write; возвращает content-type.
+
+    Бросает RemoteFetchError, если ответ не картинка, не 200 или больше max_bytes.
+    """
+    if not is_http_url(url):
+        raise RemoteFetchError("Only http(s) URLs are allowed", status_code=400)
+    client = get_client()
+    try:
+        async with client.stream("GET", url) as r:
+            if r.status_code != 200:
+                raise RemoteFetchError(f"Upstream HTTP {r.status_code}")
+            content_type = (r.headers.get("content-type") or "").split(";")[0].strip().lower()
+            looks_like_image = url.lower().split("?")[0].endswith(IMAGE_EXTENSIONS)
+            if not content_type.startswith("image/") and not (
+                looks_like_image and content_type in ("", "application/octet-stream")
+            ):
+                raise RemoteFetchError(f"Not an image: {content_type or 'unknown'}", status_code=415)
+            content_length = r.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise RemoteFetchError("Image too large", status_code=413)
+            received = 0
+            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise RemoteFetchError("Image too large", status_code=413)
+                write(chunk)
+            if not received:
+                raise RemoteFetchError("Empty response")
+            return content_type if content_type.startswith("image/") else "image/jpeg"
+    except httpx.HTTPError as e:
+        raise RemoteFetchError(f"Upstream error: {e}") from e
+
+
+async def fetch_image_bytes(url: str, max_bytes: int = MAX_REMOTE_IMAGE_BYTES) -> Tuple[bytes, str]:
+    buf = bytearray()
+    content_type = await stream_image(url, buf.extend, max_bytes)
+    return bytes(buf), content_type
@@ -0,0 +1,127 @@
+import io
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # без Pillow отдаём только оригиналы
+
+from .cache import DiskLRUCache
+from .db import PROJECT_ROOT
+
+# Форматы уменьшенных копий: имя в запросе -> (формат Pillow, content-type)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+MIN_VARIANT_WIDTH = 16
+MAX_VARIANT_WIDTH = 2048
+VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", str(PROJECT_ROOT / ".cache" / "images")))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+
+# Кэш ответов /api/proxy: ключ — URL, записи живут PROXY_CACHE_TTL секунд
+PROXY_CACHE_DIR = Path(os.getenv("PROXY_CACHE_DIR", str(PROJECT_ROOT / ".cache" / "proxy")))
+PROXY_CACHE_MAX_BYTES = int(os.getenv("PROXY_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+PROXY_CACHE_TTL = int(os.getenv("PROXY_CACHE_TTL", str(7 * 24 * 3600)))  # неделя
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+variant_cache = DiskLRUCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+proxy_cache = DiskLRUCache(PROXY_CACHE_DIR, PROXY_CACHE_MAX_BYTES, ttl_seconds=PROXY_CACHE_TTL)
+
+
+def variants_supported() -> bool:
+    return Image is not None
+
+
+def render_variant(img_bytes: bytes, width: int, fmt: str) -> bytes:
+    """Уменьшает изображение до ширины width (без увеличения) и кодирует в fmt."""
+    pil_format, _ = VARIANT_FORMATS[fmt]
+    with Image.open(io.BytesIO(img_bytes)) as src:
+        # draft() позволяет JPEG-декодеру сразу читать уменьшенную копию
+        if src.width > width:
+            src.draft("RGB", (width, max(1, round(src.height * width / src.width))))
+        has_alpha = src.mode in ("RGBA", "LA", "PA") or "transparency" in src.info
+        img = src.convert("RGBA" if has_alpha else "RGB")
+    if img.width > width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+
+    if pil_format == "JPEG" and img.mode == "RGBA":
+        # JPEG не умеет прозрачность — кладём на белый фон
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+
+    out = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    elif pil_format == "WEBP":
+        img.save(out, format="WEBP", quality=VARIANT_QUALITY, method=4)
+    else:
+        img.save(out, format="JPEG", quality=VARIANT_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def variant_key(product_id: int, version: str, width: int, fmt: str) -> str:
+    return f"{product_id}:{version}:{width}:{fmt}"
+
+
+def get_variant_path(
+    product_id: int, version: str, width: int, fmt: str, load_bytes: Callable[[], Optional[bytes]]
+) -> Optional[Path]:
+    """Отдаёт путь к уменьшенной копии из дискового кэша, при промахе генерирует её.
+
+    version должен меняться вместе с содержимым картинки — он входит в ключ кэша.
+    Оригинал читается через load_bytes только при промахе.
+    """
+    key = variant_key(product_id, version, width, fmt)
+    path = variant_cache.get(key)
+    if path is not None:
+        return path
+    img_bytes = load_bytes()
+    if not img_bytes:
+        return None
+    try:
+        data = render_variant(img_bytes, width, fmt)
+    except Exception as e:
+        print(f"[IMAGE] Не удалось построить копию {key}: {e}")
+        return None
+    return variant_cache.put(key, data)
+
+
+def quote_etag(value: str) -> str:
+    return f'"{value}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (список, слабые ETag, "*")"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+def image_cache_headers(etag: str, last_modified: Optional[datetime], immutable: bool) -> Dict[str, str]:
+    """Заголовки кэширования: URL с ?v=<etag> неизменяемы, без версии — только с перепроверкой"""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
@@ -1,11 +1,3 @@
-import sys
-import math
-import pandas as pd
-from sqlmodel import select
-
-from .db import init_db, get_session
-from .models import Product
-
 """
 Ожидаемые колонки в Excel:
 - name (обязательно)
@@ -16,111 +8,291 @@ from .models import Product
 
 Пример запуска:
 python -m backend.import_excel "/полный/путь/к/файлу.xlsx"
+
+Большие прайсы — кусками, с продолжением после падения:
+python -m backend.import_excel --stream --batch-size 5000 "/путь/к/прайсу.xlsx"
+python -m backend.import_excel "/путь/к/прайсу.csv"
+
+С --fetch-images после импорта скачиваются картинки товаров, у которых их ещё нет в базе;
+при записи считаются размер, формат и палитра (backend/palette.py).
+В конце пересобирается снимок каталога для /api/catalog/snapshot (backend/snapshot.py).
 """
 
+import csv
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import text
+
+from .db import engine, init_db, get_read_session, get_session, read_engine
+from .downloader import MAX_IMAGE_SIZE_BYTES, ConcurrentDownloader
+from .models import Product, save_product_image
+from .snapshot import write_catalog_snapshot
+
 
 def normalize_column_name(column_name: str) -> str:
     return column_name.strip().lower().replace(" ", "_")
 
 
-def first_existing(df: pd.DataFrame, candidates: list[str]) -> str | None:
+def first_existing(columns: Iterable[str], candidates: list[str]) -> str | None:
+    present = set(columns)
     for c in candidates:
-        if c in df.columns:
+        if c in present:
             return c
     return None
 
 
+OPTIONAL_COLUMNS = ("category", "color", "tags")
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMAGE_COMMIT_EVERY = 50
+
+
+def detect_columns(columns: Iterable[str]) -> dict[str, str | None]:
+    """Определяет колонки по нескольким вариантам из файла: поле Product -> колонка файла"""
+    columns = list(columns)
+    detected = {
+        "name": first_existing(columns, ["name", "title", "наименование", "название"]),
+        "image_url": first_existing(
+            columns,
+            [
+                "фото1",
+                "photo",
+                "picture",
+                "image_url",
+                "image",
+                "main_image",
+            ],
+        ),
+        "category": first_existing(columns, ["category", "категория"]),
+        "color": first_existing(columns, ["color"]),
+        "tags": first_existing(columns, ["tags"]),
+    }
+    if not detected["name"]:
+        raise ValueError("Не найдена колонка с названием товара (name/title/наименование)")
+    if not detected["image_url"]:
+        raise ValueError("Не найдена колонка с ссылкой на картинку (Фото1/Photo/picture/image_url)")
+    return detected
+
+
+def clean_column(df: pd.DataFrame, column: str | None) -> pd.Series:
+    """Колонка как строки без пробелов по краям; пустые ячейки (NaN) — пустая строка"""
+    if column is None:
+        return pd.Series("", index=df.index, dtype=object)
+    values = df[column]
+    return values.where(values.notna(), "").astype(str).str.strip()
+
+
+def prepare_rows(df: pd.DataFrame, columns: dict[str, str | None]) -> list[dict]:
+    """Чистка и фильтрация — операциями над целыми колонками, без цикла по строкам"""
+    products = pd.DataFrame({field: clean_column(df, column) for field, column in columns.items()})
+    products = products[(products["name"] != "") & (products["image_url"] != "")]
+    # Повторы внутри куска; повторы с базой отсечёт ON CONFLICT по уникальному индексу
+    products = products.drop_duplicates(subset=["name", "image_url"])
+    products = products.astype(object)
+    for column in OPTIONAL_COLUMNS:
+        products.loc[products[column] == "", column] = None
+    return products.to_dict("records")
+
+
+def insert_ignoring_duplicates(session, rows: list[dict]) -> int:
+    """INSERT ... ON CONFLICT (name, image_url) DO NOTHING одним executemany; возвращает число новых строк"""
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(Product.__table__).on_conflict_do_nothing(index_elements=["name", "image_url"])
+    return session.execute(stmt, rows).rowcount
+
+
 def main(xlsx_path: str) -> None:
     init_db()
     df = pd.read_excel(xlsx_path)
     df.columns = [normalize_column_name(str(c)) for c in df.columns]
+    rows = prepare_rows(df, detect_columns(df.columns))
 
-    # Определяем колонки по нескольким вариантам из файла
-    name_col = first_existing(df, ["name", "title", "наименование", "название"])
-    category_col = first_existing(df, ["category", "категория"])
-    image_col = first_existing(
-        df,
-        [
-            "фото1",
-            "photo",
-            "picture",
-            "image_url",
-            "image",
-            "main_image",
-        ],
-    )
+    with get_session() as session:
+        created = insert_ignoring_duplicates(session, rows)
+        session.commit()
 
-    if not name_col:
-        raise ValueError("Не найдена колонка с названием товара (name/title/наименование)")
-    if not image_col:
-        raise ValueError("Не найдена колонка с ссылкой на картинку (Фото1/Photo/picture/image_url)")
+    skipped = len(df) - created
+    print(f"Импорт завершён. Создано: {created}, пропущено: {skipped}")
 
+
+def save_fetched_images(images: list[tuple[int, bytes]]) -> None:
+    """Пишет скачанные картинки одной короткой транзакцией"""
+    if not images:
+        return
     with get_session() as session:
-        created = 0
-        skipped = 0
-        for _, row in df.iterrows():
-            raw_name = row.get(name_col, "")
-            raw_img = row.get(image_col, "")
-            if isinstance(raw_name, float) and math.isnan(raw_name):
-                raw_name = ""
-            if isinstance(raw_img, float) and math.isnan(raw_img):
-                raw_img = ""
-
-            name = str(raw_name).strip()
-            image_url = str(raw_img).strip()
-            if not name or not image_url:
-                skipped += 1
-                continue
-
-            category = None
-            if category_col is not None:
-                raw_cat = row.get(category_col, "")
-                if isinstance(raw_cat, float) and math.isnan(raw_cat):
-                    raw_cat = ""
-                category = str(raw_cat).strip() or None
-
-            color = None
-            if "color" in df.columns:
-                rc = row.get("color", "")
-                if isinstance(rc, float) and math.isnan(rc):
-                    rc = ""
-                color = str(rc).strip() or None
-            tags = None
-            if "tags" in df.columns:
-                rt = row.get("tags", "")
-                if isinstance(rt, float) and math.isnan(rt):
-                    rt = ""
-                tags = str(rt).strip() or None
-
-            exists = session.exec(
-                select(Product).where(
-                    Product.name == name,
-                    Product.image_url == image_url,
-                )
-            ).first()
-            if exists:
-                skipped += 1
-                continue
-
-            p = Product(
-                name=name,
-                category=category,
-                image_url=image_url,
-                color=color,
-                tags=tags,
+        for product_id, data in images:
+            save_product_image(session, product_id, data)
+        session.commit()
+
+
+def fetch_missing_images() -> int:
+    """Скачивает оригиналы для товаров без картинки в product_image; возвращает число сохранённых.
+
+    Список читается через read_engine, а запись идёт пачками по IMAGE_COMMIT_EVERY уже скачанных
+    картинок: блокировка записи не держится, пока идут загрузки.
+    """
+    with get_read_session() as session:
+        missing = session.exec(
+            text(
+                "SELECT id, image_url FROM product WHERE image_etag IS NULL "
+                "AND (image_url LIKE 'http://%' OR image_url LIKE 'https://%') ORDER BY id"
             )
-            session.add(p)
-            created += 1
+        ).all()
+    if not missing:
+        return 0
+    print(f"Скачиваем картинки: {len(missing)}")
+    saved = 0
+    ready: list[tuple[int, bytes]] = []
+    downloader = ConcurrentDownloader(max_bytes=MAX_IMAGE_SIZE_BYTES, label="import")
+    for (product_id, _), result in downloader.map(missing, lambda row: row[1], total=len(missing)):
+        if not result.data:
+            continue
+        ready.append((product_id, result.data))
+        saved += 1
+        if len(ready) >= IMAGE_COMMIT_EVERY:
+            save_fetched_images(ready)
+            ready = []
+    save_fetched_images(ready)
+    print(f"Картинок сохранено: {saved}, не скачалось: {len(missing) - saved}")
+    return saved
 
-        session.commit()
 
-    print(f"Импорт завершён. Создано: {created}, пропущено: {skipped}")
+# --- Потоковый режим для больших файлов ---
+
+_PROGRESS_DDL = """CREATE TABLE IF NOT EXISTS import_progress (
+    source TEXT PRIMARY KEY,
+    rows_done INTEGER NOT NULL
+)"""
+
+
+def source_key(path: Path) -> str:
+    """Ключ прогресса: путь + размер + время изменения (изменённый файл импортируется заново)"""
+    st = path.stat()
+    return f"{path.resolve()}:{st.st_size}:{int(st.st_mtime)}"
+
+
+def load_progress(session, key: str) -> int:
+    session.exec(text(_PROGRESS_DDL))
+    done = session.exec(text("SELECT rows_done FROM import_progress WHERE source = :key").bindparams(key=key)).scalar()
+    session.commit()
+    return done or 0
+
+
+def save_progress(session, key: str, rows_done: int) -> None:
+    # В той же транзакции, что и строки куска: после падения продолжаем ровно с него
+    session.exec(
+        text(
+            "INSERT INTO import_progress(source, rows_done) VALUES (:key, :done) "
+            "ON CONFLICT(source) DO UPDATE SET rows_done = excluded.rows_done"
+        ).bindparams(key=key, done=rows_done)
+    )
+
+
+def clear_progress(session, key: str) -> None:
+    session.exec(text("DELETE FROM import_progress WHERE source = :key").bindparams(key=key))
+    session.commit()
+
+
+def iter_xlsx_chunks(path: Path, batch_size: int, skip_rows: int) -> Iterator[pd.DataFrame]:
+    """Читает первый лист через openpyxl в режиме read_only — в памяти только текущий кусок"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [normalize_column_name(str(c)) for c in header]
+        rows = islice(rows, skip_rows, None)
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(path: Path, batch_size: int, skip_rows: int) -> Iterator[pd.DataFrame]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(64 * 1024)
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+    except csv.Error:
+        delimiter = ","
+    reader = pd.read_csv(
+        path,
+        sep=delimiter,
+        dtype=str,
+        encoding="utf-8-sig",
+        chunksize=batch_size,
+        skiprows=range(1, skip_rows + 1),
+    )
+    with reader:
+        for chunk in reader:
+            chunk.columns = [normalize_column_name(str(c)) for c in chunk.columns]
+            yield chunk
+
+
+def main_stream(path_str: str, batch_size: int = IMPORT_BATCH_SIZE, restart: bool = False) -> None:
+    """Импорт кусками по batch_size строк с коммитом после каждого; после падения продолжает
+    с последнего закоммиченного куска"""
+    init_db()
+    path = Path(path_str)
+    iter_chunks = iter_csv_chunks if path.suffix.lower() in (".csv", ".txt") else iter_xlsx_chunks
+    key = source_key(path)
+
+    with get_session() as session:
+        rows_done = 0 if restart else load_progress(session, key)
+        if rows_done:
+            print(f"Продолжаем импорт со строки {rows_done + 1}")
+        created = 0
+        read = 0
+        columns = None
+        for chunk in iter_chunks(path, batch_size, rows_done):
+            if columns is None:
+                columns = detect_columns(chunk.columns)
+            created += insert_ignoring_duplicates(session, prepare_rows(chunk, columns))
+            read += len(chunk)
+            save_progress(session, key, rows_done + read)
+            session.commit()
+            print(f"  строк обработано: {rows_done + read}, создано: {created}")
+        clear_progress(session, key)
+
+    print(f"Импорт завершён. Создано: {created}, пропущено: {read - created}")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Укажи путь к Excel: python -m backend.import_excel /path/to/file.xlsx")
-        sys.exit(1)
-    main(sys.argv[1])
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Импорт товаров из Excel/CSV")
+    parser.add_argument("path", help="путь к .xlsx или .csv")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="читать файл кусками (постоянная память, продолжение после падения); для .csv включён всегда",
+    )
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="строк в одной транзакции")
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя сохранённый прогресс")
+    parser.add_argument(
+        "--fetch-images",
+        action="store_true",
+        help="после импорта скачать картинки и посчитать их размер и палитру",
+    )
+    args = parser.parse_args()
 
+    if args.stream or args.path.lower().endswith((".csv", ".txt")):
+        main_stream(args.path, batch_size=max(1, args.batch_size), restart=args.restart)
+    else:
+        main(args.path)
+    if args.fetch_images:
+        fetch_missing_images()
+    write_catalog_snapshot(read_engine, engine)
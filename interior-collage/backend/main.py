@@ -1,19 +1,83 @@
+import asyncio
 import os
-from typing import List, Optional, Dict, Any
+from typing import Annotated, List, Optional, Dict, Any, Tuple
 from pydantic import BaseModel, ConfigDict
 
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, Response
-from sqlmodel import select, text
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete, func, select
 
 # Импортируем db - он сам загрузит .env
-from .db import init_db, get_session, DATABASE_URL
-from .models import Product
+from .db import (
+    DATABASE_URL,
+    get_read_session,
+    get_session,
+    init_db,
+    read_session_dependency,
+    session_dependency,
+)
+from .models import (
+    IMAGE_VARIANTS,
+    ORIGINAL_VARIANT,
+    Collage,
+    Product,
+    ProductImage,
+    ProductSignature,
+    save_product_image,
+    sniff_content_type,
+)
+from .collages import (
+    CollageCreate,
+    CollagePatch,
+    CollageResponse,
+    CollageSummary,
+    VersionConflict,
+    append_ops,
+    compact_collage,
+    create_collage,
+    delete_collage,
+    load_elements,
+    needs_compaction,
+)
+from .facets import facet_cache
+from .fetch import (
+    MAX_REMOTE_IMAGE_BYTES,
+    RemoteFetchError,
+    SingleFlight,
+    close_client,
+    fetch_image_bytes,
+)
+from .pagination import decode_cursor, encode_cursor
+from .palette import hex_to_lab
+from .similar import similarity_index
+from .snapshot import catalog_snapshot, choose_encoding
+from .search import build_match_query, fts_supported, search_subquery
+from .images import (
+    MAX_VARIANT_WIDTH,
+    MIN_VARIANT_WIDTH,
+    PROXY_CACHE_TTL,
+    VARIANT_FORMATS,
+    etag_matches,
+    get_variant_path,
+    image_cache_headers,
+    proxy_cache,
+    quote_etag,
+    variants_supported,
+)
+from .render import RENDER_FORMATS, RenderRequest, missing_images, render_collage, shutdown_pool, validate_request
 
 app = FastAPI(title="Interior Collage Builder - MVP")
 
+# Сессии обработчиков закрываются сразу после них (scope="function") — до отправки ответа
+# и фоновых задач: пишущее соединение SQLite одно на процесс, держать его дольше нельзя
+ReadSession = Annotated[Session, Depends(read_session_dependency, scope="function")]
+WriteSession = Annotated[Session, Depends(session_dependency, scope="function")]
+
 # CORS
 cors_origins = os.getenv("CORS_ORIGINS", "*")
 origins_list = [o.strip() for o in cors_origins.split(",") if o.strip()]
@@ -35,69 +99,195 @@ def serve_index() -> FileResponse:
     return FileResponse(os.path.join(STATIC_DIR, "index.html"))
 
 
-# Простая прокси для изображений, чтобы обойти CORS
-try:
-    import httpx  # type: ignore
-except Exception:  # pragma: no cover
-    httpx = None  # будет установлен через зависимости
+# Прокси для изображений, чтобы обойти CORS
+proxy_flight = SingleFlight()
 
 
 @app.get("/api/proxy")
-def proxy_image(url: str) -> Response:
-    if httpx is None:
-        return Response(status_code=500, content=b"httpx not installed")
-    # безопасный таймаут и редиректы
-    with httpx.Client(follow_redirects=True, timeout=10.0) as client:
-        r = client.get(url)
-        # передаём тип контента; блокируем опасные заголовки
-        content_type = r.headers.get("content-type", "image/jpeg")
-        return Response(content=r.content, media_type=content_type)
+async def proxy_image(url: str) -> Response:
+    """Прокси для картинок с чужих сайтов: общий пул соединений, кэш на диске,
+    одновременные запросы одного URL ждут одну загрузку."""
+    # Файловый кэш — синхронный ввод-вывод, поэтому в пуле потоков, а не в цикле событий.
+    # Отдаём уже прочитанные байты: вытеснение файла не оборвёт начатый ответ
+    data = await run_in_threadpool(proxy_cache.read, url)
+    if data is None:
+        async def download() -> bytes:
+            body, _ = await fetch_image_bytes(url)
+            await run_in_threadpool(proxy_cache.put, url, body)
+            return body
 
+        try:
+            data = await proxy_flight.do(url, download)
+        except RemoteFetchError as e:
+            return Response(status_code=e.status_code, content=str(e).encode("utf-8"))
+    return Response(
+        content=data,
+        media_type=sniff_content_type(data),
+        headers={"Cache-Control": f"public, max-age={PROXY_CACHE_TTL}"},
+    )
 
-@app.get("/api/image/{product_id}")
-def get_product_image(product_id: int) -> Response:
-    """Отдает изображение продукта из базы данных (из image_blob)"""
-    with get_session() as session:
-        product = session.get(Product, product_id)
-        if not product:
+
+def _stored_image_response(
+    product_id: int,
+    image_variant: str,
+    want_variant: bool,
+    variant_width: int,
+    variant_fmt: str,
+    v: Optional[str],
+    if_none_match: Optional[str],
+) -> Tuple[Optional[Response], Optional[str]]:
+    """Ответ с картинкой из product_image и image_url товара; ответ None — картинки в базе нет"""
+    with get_read_session() as session:
+        # Сначала читаем только метаданные — BLOB нужен лишь при промахе
+        row = session.exec(
+            select(Product.image_url, ProductImage.etag, ProductImage.updated_at, ProductImage.content_type)
+            .select_from(Product)
+            .outerjoin(
+                ProductImage,
+                (ProductImage.product_id == Product.id) & (ProductImage.variant == image_variant),
+            )
+            .where(Product.id == product_id)
+        ).first()
+        if not row:
             raise HTTPException(status_code=404, detail="Product not found")
-        
-        # Если есть изображение в базе (image_blob), отдаем его
-        if product.image_blob:
-            # Определяем тип изображения по первым байтам
-            img_bytes = product.image_blob
-            if img_bytes.startswith(b'\xff\xd8\xff'):
-                content_type = "image/jpeg"
-            elif img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
-                content_type = "image/png"
-            elif img_bytes.startswith(b'GIF87a') or img_bytes.startswith(b'GIF89a'):
-                content_type = "image/gif"
-            elif img_bytes.startswith(b'RIFF') and b'WEBP' in img_bytes[:12]:
-                content_type = "image/webp"
-            else:
-                content_type = "image/jpeg"  # по умолчанию
-            
-            return Response(content=img_bytes, media_type=content_type)
-        
-        # Если изображения в базе нет, пробуем загрузить через image_url
-        if product.image_url and httpx:
-            try:
-                with httpx.Client(follow_redirects=True, timeout=10.0) as client:
-                    r = client.get(product.image_url)
-                    content_type = r.headers.get("content-type", "image/jpeg")
-                    return Response(content=r.content, media_type=content_type)
-            except Exception:
-                pass
-        
+        image_url, image_etag, image_updated_at, content_type = row
+        if not image_etag:
+            return None, image_url
+
+        def load_blob() -> Optional[bytes]:
+            return session.exec(
+                select(ProductImage.blob).where(
+                    ProductImage.product_id == product_id, ProductImage.variant == image_variant
+                )
+            ).first()
+
+        etag = quote_etag(f"{image_etag}-w{variant_width}.{variant_fmt}" if want_variant else image_etag)
+        headers = image_cache_headers(etag, image_updated_at, immutable=(v == image_etag))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers), image_url
+
+        if want_variant:
+            path = get_variant_path(product_id, image_etag, variant_width, variant_fmt, load_blob)
+            if path is not None:
+                return FileResponse(path, media_type=VARIANT_FORMATS[variant_fmt][1], headers=headers), image_url
+            headers["ETag"] = quote_etag(image_etag)
+
+        img_bytes = load_blob()
+        if not img_bytes:
+            return None, image_url
+        return Response(content=img_bytes, media_type=content_type or "image/jpeg", headers=headers), image_url
+
+
+def _store_downloaded_image(product_id: int, data: bytes) -> None:
+    with get_session() as session:
+        if session.get(Product, product_id) is None:
+            return  # товар успели удалить, пока качали картинку
+        save_product_image(session, product_id, data)
+        session.commit()
+
+
+async def _backfill_product_image(product_id: int, image_url: str) -> None:
+    """Скачивает картинку по image_url и сохраняет её в product_image, чтобы больше не ходить в сеть"""
+    data, _ = await fetch_image_bytes(image_url, MAX_REMOTE_IMAGE_BYTES)
+    await run_in_threadpool(_store_downloaded_image, product_id, data)
+    # Размер и палитра картинки попадают в снимок каталога; ответ пересборку не ждёт
+    asyncio.get_running_loop().run_in_executor(None, catalog_snapshot.refresh)
+
+
+backfill_flight = SingleFlight()
+
+
+@app.get("/api/image/{product_id}")
+async def get_product_image(
+    product_id: int,
+    w: Optional[int] = Query(default=None, ge=MIN_VARIANT_WIDTH, le=MAX_VARIANT_WIDTH, description="ширина уменьшенной копии"),
+    fmt: Optional[str] = Query(default=None, description="формат копии: webp/jpeg/png"),
+    v: Optional[str] = Query(default=None, description="версия картинки (image_etag) для вечного кэширования"),
+    variant: str = Query(default=ORIGINAL_VARIANT, description="original или cutout (без фона)"),
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    """Отдает изображение продукта из базы данных (из таблицы product_image).
+
+    С параметрами w/fmt отдаёт уменьшенную копию из дискового кэша (для миниатюр каталога).
+    variant=cutout — картинка без фона (PNG с альфой), если её уже построил remove_bg.py.
+    Повторный запрос с If-None-Match получает 304 без чтения BLOB.
+    Если оригинала в базе нет, он один раз скачивается по image_url и сохраняется в базу.
+    """
+    if fmt is not None and fmt.lower() not in VARIANT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported variant: {variant}")
+    args = (
+        product_id,
+        variant,
+        (w is not None or fmt is not None) and variants_supported(),
+        w or MAX_VARIANT_WIDTH,
+        (fmt or "webp").lower(),
+        v,
+        if_none_match,
+    )
+
+    # Работа с SQLite синхронная — выполняем её в пуле потоков
+    response, image_url = await run_in_threadpool(_stored_image_response, *args)
+    if response is not None:
+        return response
+    if not image_url or variant != ORIGINAL_VARIANT:
+        # Вырезанную картинку скачать неоткуда — её строит только remove_bg.py
         raise HTTPException(status_code=404, detail="Image not found")
 
+    # Одновременные запросы одного товара ждут одну загрузку
+    try:
+        await backfill_flight.do(
+            f"product:{product_id}", lambda: _backfill_product_image(product_id, image_url)
+        )
+    except RemoteFetchError:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    response, _ = await run_in_threadpool(_stored_image_response, *args)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
 
 @app.on_event("startup")
 def on_startup() -> None:
     init_db()
 
 
-# Response модель без image_blob (для Pydantic v2)
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    await close_client()
+    shutdown_pool()
+
+
+@app.post("/api/render")
+async def render_collage_image(spec: RenderRequest) -> FileResponse:
+    """Рендерит коллаж на сервере в любом разрешении (pixel_ratio) из картинок product_image.
+
+    Работа идёт в пуле процессов; холст собирается полосами, PNG пишется по мере готовности,
+    так что большие экспорты не раздувают память сервера.
+    """
+    try:
+        validate_request(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    missing = await run_in_threadpool(missing_images, spec)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Image not found for products: {missing}")
+
+    path = await render_collage(spec)
+    fmt = spec.format.lower()
+    return FileResponse(
+        path,
+        media_type=RENDER_FORMATS[fmt],
+        filename=f"collage.{'jpg' if fmt == 'jpeg' else fmt}",
+        background=BackgroundTask(path.unlink, missing_ok=True),
+    )
+
+
+# Response модель товара для списков (сами картинки лежат отдельно, в product_image)
 class ProductResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     
@@ -107,57 +297,353 @@ class ProductResponse(BaseModel):
     image_url: str
     color: Optional[str] = None
     tags: Optional[str] = None
+    image_etag: Optional[str] = None  # версия картинки для /api/image/{id}?v=...
+    cutout_etag: Optional[str] = None  # есть картинка без фона: /api/image/{id}?variant=cutout&v=...
+    image_width: Optional[int] = None  # размер оригинала — холсту не нужно ждать загрузки картинки
+    image_height: Optional[int] = None
+    image_format: Optional[str] = None
+    image_has_alpha: Optional[bool] = None
+    palette: Optional[str] = None  # основные цвета картинки: "#rrggbb,#rrggbb,..."
+
 
+class ProductPage(BaseModel):
+    items: List[ProductResponse]
+    next_cursor: Optional[str] = None  # None — это последняя страница
+    total: Optional[int] = None  # только по запросу with_total на первой странице
 
-@app.get("/api/products", response_model=List[ProductResponse])
+
+@app.get("/api/products", response_model=ProductPage)
 def list_products(
+    session: ReadSession,
     search: Optional[str] = Query(default=None, description="поиск по имени/тегам"),
     category: Optional[str] = Query(default=None),
-    limit: int = 50,
-    offset: int = 0,
-):
-    with get_session() as session:
-        stmt = select(Product)
-        if search:
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = Query(default=None, description="next_cursor из предыдущей страницы"),
+    offset: int = Query(default=0, ge=0, description="устарело, используйте cursor"),
+    with_total: bool = Query(default=False, description="посчитать общее количество (только без cursor)"),
+    near_color: Optional[str] = Query(default=None, description="#rrggbb: товары с близким основным цветом"),
+    color_distance: float = Query(default=20.0, gt=0, le=100, description="радиус по цвету (ΔE в Lab)"),
+) -> ProductPage:
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        target_lab = hex_to_lab(near_color) if near_color else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rank = None
+    fts = None
+    filters = []
+    if search:
+        match_query = build_match_query(search)
+        if fts_supported(session.get_bind()) and match_query:
+            # Полнотекстовый индекс: порядок — по релевантности
+            fts = search_subquery(match_query)
+            rank = fts.c.rank
+        else:
             s = f"%{search.lower()}%"
-            stmt = stmt.where((Product.name.ilike(s)) | (Product.tags.ilike(s)))
-        if category:
-            stmt = stmt.where(Product.category == category)
-        stmt = stmt.offset(offset).limit(limit)
-        products = session.exec(stmt).all()
-        # Преобразуем в response модель (исключаем image_blob автоматически)
-        return [ProductResponse.model_validate(p) for p in products]
+            filters.append((Product.name.ilike(s)) | (Product.tags.ilike(s)))
+    if category:
+        filters.append(Product.category == category)
+    if target_lab is not None:
+        # Сначала куб вокруг цвета (по индексу ix_product_dominant_lab), потом точная сфера ΔE
+        l, a, b = target_lab
+        r = color_distance
+        distance = (
+            (Product.dominant_l - l) * (Product.dominant_l - l)
+            + (Product.dominant_a - a) * (Product.dominant_a - a)
+            + (Product.dominant_b - b) * (Product.dominant_b - b)
+        )
+        filters += [
+            Product.dominant_a.between(a - r, a + r),
+            Product.dominant_b.between(b - r, b + r),
+            Product.dominant_l.between(l - r, l + r),
+            distance <= r * r,
+        ]
+        if rank is None:
+            # Без поиска — ближайшие цвета первыми (расстояние работает как rank в курсоре)
+            rank = distance.label("rank")
+
+    stmt = select(Product) if rank is None else select(Product, rank)
+    if fts is not None:
+        stmt = stmt.join(fts, fts.c.product_id == Product.id)
+    stmt = stmt.where(*filters)
+
+    total = None
+    if with_total and after is None:
+        if search or target_lab is not None:
+            total = session.exec(select(func.count()).select_from(stmt.subquery())).one()
+        else:
+            # Без поиска количество берём из материализованных счётчиков
+            facets = facet_cache.get(session)
+            total = facets["category"].get(category, 0) if category else facets["total"]
+
+    # Keyset-пагинация: следующая страница начинается сразу после ключа последней строки,
+    # поэтому глубокие страницы стоят столько же, сколько первая
+    if rank is not None:
+        if after is not None:
+            last_rank = float(after.get("rank", 0.0))
+            stmt = stmt.where((rank > last_rank) | ((rank == last_rank) & (Product.id > after["id"])))
+        stmt = stmt.order_by(rank, Product.id)
+    else:
+        if after is not None:
+            stmt = stmt.where(Product.id > after["id"])
+        stmt = stmt.order_by(Product.id)
+    if after is None and offset:
+        stmt = stmt.offset(offset)
+
+    rows = session.exec(stmt.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        if rank is not None:
+            last_product, last_rank = rows[-1]
+            next_cursor = encode_cursor({"id": last_product.id, "rank": last_rank})
+        else:
+            next_cursor = encode_cursor({"id": rows[-1].id})
+
+    products = [row[0] for row in rows] if rank is not None else rows
+    # Преобразуем в response модель
+    return ProductPage(
+        items=[ProductResponse.model_validate(p) for p in products],
+        next_cursor=next_cursor,
+        total=total,
+    )
+
+
+class SimilarProduct(ProductResponse):
+    score: float  # 0..1, больше — похожее
+
+
+# Запас на товары, удалённые другими процессами: индекс узнаёт о них только из базы
+SIMILAR_OVERFETCH = 10
+
+
+@app.get("/api/products/{product_id}/similar", response_model=List[SimilarProduct])
+def similar_products(session: ReadSession, product_id: int, k: int = Query(default=20, ge=1, le=100)) -> List[SimilarProduct]:
+    """Похожие по картинке товары: цвет, фактура, силуэт и перцептивный хэш (backend/similar.py)"""
+    if session.get(Product, product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    matches = similarity_index.query(session.connection(), product_id, k + SIMILAR_OVERFETCH)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Product image is not indexed yet")
+    products = {
+        p.id: p
+        for p in session.exec(select(Product).where(Product.id.in_([pid for pid, _ in matches]))).all()
+    }
+    result = [
+        SimilarProduct(**ProductResponse.model_validate(products[pid]).model_dump(), score=round(score, 4))
+        for pid, score in matches
+        if pid in products
+    ]
+    return result[:k]
 
 
 @app.get("/api/categories", response_model=List[str])
-def list_categories() -> List[str]:
-    with get_session() as session:
-        rows = session.exec(select(Product.category)).all()
-    cats = sorted({c for c in rows if c})
-    return cats
+def list_categories(session: ReadSession) -> List[str]:
+    return facet_cache.categories(session)
+
+
+@app.get("/api/facets")
+def list_facets(session: ReadSession) -> Dict[str, Any]:
+    """Счётчики товаров по категориям и цветам + версия каталога"""
+    return facet_cache.get(session)
+
+
+@app.get("/api/catalog/snapshot")
+def get_catalog_snapshot(
+    session: ReadSession,
+    accept_encoding: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    """Весь каталог одним JSON {total, items} (поля как в ProductResponse) для фильтрации на клиенте.
+
+    Тело заранее сжато (br или gzip по Accept-Encoding); повторный запрос с If-None-Match
+    получает 304, пока каталог не изменился.
+    """
+    snapshot = catalog_snapshot.get(session)
+    encoding = choose_encoding(accept_encoding, snapshot.brotli is not None)
+    etag = quote_etag(snapshot.etag_for(encoding))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=snapshot.body(encoding), media_type="application/json", headers=headers)
+
+
+class ProductCreate(BaseModel):
+    name: str
+    category: Optional[str] = None
+    image_url: str
+    color: Optional[str] = None
+    tags: Optional[str] = None
+
+
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    category: Optional[str] = None
+    image_url: Optional[str] = None
+    color: Optional[str] = None
+    tags: Optional[str] = None
+
+
+def _commit_product(session) -> None:
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Product with this name and image_url already exists")
+
+
+async def _prefetch_product_image(product_id: int, image_url: str) -> None:
+    """Скачивает картинку нового товара сразу: при записи считаются размер, формат и палитра"""
+    try:
+        await backfill_flight.do(f"product:{product_id}", lambda: _backfill_product_image(product_id, image_url))
+    except RemoteFetchError as e:
+        print(f"[WARN] Не удалось скачать картинку товара {product_id}: {e}")
+
+
+@app.post("/api/products", response_model=ProductResponse, status_code=201)
+def create_product(session: WriteSession, data: ProductCreate, background_tasks: BackgroundTasks) -> ProductResponse:
+    product = Product(**data.model_dump())
+    session.add(product)
+    _commit_product(session)
+    session.refresh(product)
+    background_tasks.add_task(catalog_snapshot.refresh)
+    if product.image_url.startswith(("http://", "https://")):
+        background_tasks.add_task(_prefetch_product_image, product.id, product.image_url)
+    return ProductResponse.model_validate(product)
+
+
+@app.put("/api/products/{product_id}", response_model=ProductResponse)
+def update_product(
+    session: WriteSession, product_id: int, data: ProductUpdate, background_tasks: BackgroundTasks
+) -> ProductResponse:
+    product = session.get(Product, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    for key, value in data.model_dump(exclude_unset=True).items():
+        setattr(product, key, value)
+    session.add(product)
+    _commit_product(session)
+    session.refresh(product)
+    background_tasks.add_task(catalog_snapshot.refresh)
+    return ProductResponse.model_validate(product)
+
+
+@app.delete("/api/products/{product_id}", status_code=204)
+def delete_product(session: WriteSession, product_id: int, background_tasks: BackgroundTasks) -> Response:
+    product = session.get(Product, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    # Картинки удаляем явно: в SQLite внешние ключи по умолчанию не проверяются
+    session.exec(delete(ProductImage).where(ProductImage.product_id == product_id))
+    session.exec(delete(ProductSignature).where(ProductSignature.product_id == product_id))
+    session.delete(product)
+    session.commit()
+    similarity_index.discard(product_id)
+    background_tasks.add_task(catalog_snapshot.refresh)
+    return Response(status_code=204)
+
+
+# --- Коллажи ---
+
+def _collage_etag(collage_id: int, version: int) -> str:
+    return quote_etag(f"collage-{collage_id}-v{version}")
+
+
+@app.post("/api/collages", response_model=CollageResponse, status_code=201)
+def create_collage_endpoint(session: WriteSession, data: CollageCreate) -> CollageResponse:
+    """Сохраняет новый коллаж целиком; дальше редактор шлёт только правки (PATCH)"""
+    collage = create_collage(session, data)
+    session.commit()
+    session.refresh(collage)
+    return CollageResponse(**collage.model_dump(exclude={"elements_json", "base_version"}), elements=data.elements)
+
+
+@app.get("/api/collages", response_model=List[CollageSummary])
+def list_collages(
+    session: ReadSession,
+    user_id: Optional[str] = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=500),
+) -> List[CollageSummary]:
+    """Список коллажей без элементов (снимки не читаются), свежие сверху"""
+    stmt = select(
+        Collage.id, Collage.user_id, Collage.title, Collage.version, Collage.created_at, Collage.updated_at
+    )
+    if user_id is not None:
+        stmt = stmt.where(Collage.user_id == user_id)
+    rows = session.exec(stmt.order_by(Collage.updated_at.desc(), Collage.id.desc()).limit(limit)).all()
+    return [CollageSummary(**row._mapping) for row in rows]
+
+
+@app.get("/api/collages/{collage_id}", response_model=CollageResponse)
+def get_collage(session: ReadSession, collage_id: int, if_none_match: Optional[str] = Header(default=None)) -> Response:
+    """Текущее состояние коллажа. ETag — версия: повторная загрузка без изменений получает 304"""
+    version = session.exec(select(Collage.version).where(Collage.id == collage_id)).first()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Collage not found")
+    etag = _collage_etag(collage_id, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    collage = session.get(Collage, collage_id)
+    body = CollageResponse(
+        **collage.model_dump(exclude={"elements_json", "base_version"}),
+        elements=list(load_elements(session, collage).values()),
+    )
+    headers["ETag"] = _collage_etag(collage_id, collage.version)
+    return Response(content=body.model_dump_json(), media_type="application/json", headers=headers)
+
+
+@app.patch("/api/collages/{collage_id}")
+def patch_collage(session: WriteSession, collage_id: int, patch: CollagePatch, background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """Автосохранение: операции add/move/transform/delete поверх base_version.
+
+    409 — коллаж уже изменён (в ответе текущая версия): клиенту нужно перечитать его и повторить.
+    """
+    try:
+        version = append_ops(session, collage_id, patch)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Collage not found")
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "version": e.current})
+    session.commit()
+    if needs_compaction(session, collage_id):
+        background_tasks.add_task(compact_collage, collage_id)
+    return {"id": collage_id, "version": version}
+
+
+@app.delete("/api/collages/{collage_id}", status_code=204)
+def delete_collage_endpoint(session: WriteSession, collage_id: int) -> Response:
+    if not delete_collage(session, collage_id):
+        raise HTTPException(status_code=404, detail="Collage not found")
+    session.commit()
+    return Response(status_code=204)
 
 
 @app.get("/api/debug/db-info")
 def debug_db_info() -> Dict[str, Any]:
     """Временный endpoint для проверки подключения к БД"""
     try:
-        with get_session() as session:
-            # Проверяем количество записей
-            count_result = session.exec(text("SELECT COUNT(*) FROM product")).first()
-            # Получаем все категории
-            categories_result = session.exec(
-                text("SELECT DISTINCT category FROM product WHERE category IS NOT NULL AND category != ''")
-            ).all()
+        with get_read_session() as session:
+            # Количество записей и категории — из счётчиков фасетов, без сканирования таблицы
+            facets = facet_cache.get(session)
             # Получаем несколько примеров продуктов
             sample_products = session.exec(
                 select(Product).limit(5)
             ).all()
             
+        categories = sorted(facets["category"])
         return {
             "database_url": DATABASE_URL,
-            "total_products": count_result,
-            "categories": categories_result,
-            "categories_count": len(categories_result) if categories_result else 0,
+            "catalog_version": facets["version"],
+            "total_products": facets["total"],
+            "categories": categories,
+            "categories_count": len(categories),
             "sample_products": [
                 {"name": p.name, "category": p.category, "id": p.id} 
                 for p in sample_products
@@ -169,5 +655,3 @@ def debug_db_info() -> Dict[str, Any]:
             "error": str(e),
             "error_type": type(e).__name__
         }
-
-
@@ -0,0 +1,179 @@
+"""
+Доводит схему уже существующей базы (products.db, catalog.db) до текущих моделей.
+create_all() создаёт только отсутствующие таблицы, поэтому новые колонки добавляем сами.
+
+Пример запуска для отдельного файла:
+python -m backend.migrations shared/catalog.db
+"""
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlmodel import SQLModel, Session, text
+
+from .models import ORIGINAL_VARIANT, save_product_image, store_image_analysis
+from .palette import UNKNOWN_FORMAT, analysis_supported
+from .facets import ensure_facets
+from .search import ensure_search_index
+
+MIGRATION_BATCH = 100
+
+
+def add_missing_columns(engine: Engine) -> None:
+    """Добавляет в существующие таблицы колонки, которые появились в моделях позже"""
+    with engine.begin() as conn:
+        # Инспектор — на том же соединении: второе пишущее соединение ждало бы это
+        inspector = sa_inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+                print(f"[DB] Добавлена колонка {table.name}.{column.name}")
+
+
+def drop_duplicate_products(engine: Engine) -> int:
+    """Перед созданием уникального индекса (name, image_url) удаляет повторы.
+
+    Из каждой группы остаётся самый ранний товар с картинкой, а если картинок нет ни у кого —
+    просто самый ранний. Вызывается после move_image_blobs, поэтому смотрит в product_image.
+    Возвращает количество удалённых строк.
+    """
+    if "ux_product_name_image_url" in {i["name"] for i in sa_inspect(engine).get_indexes("product")}:
+        return 0
+    duplicates = (
+        "SELECT id FROM ("
+        "SELECT p.id, ROW_NUMBER() OVER ("
+        "PARTITION BY p.name, p.image_url ORDER BY EXISTS "
+        "(SELECT 1 FROM product_image pi WHERE pi.product_id = p.id AND pi.variant = :variant) DESC, p.id"
+        ") AS rn FROM product p"
+        ") AS ranked WHERE rn > 1"
+    )
+    params = {"variant": ORIGINAL_VARIANT}
+    with engine.begin() as conn:
+        # Картинки и подписи удаляем явно: в SQLite внешние ключи по умолчанию не проверяются
+        conn.execute(text(f"DELETE FROM product_image WHERE product_id IN ({duplicates})"), params)
+        conn.execute(text(f"DELETE FROM product_signature WHERE product_id IN ({duplicates})"), params)
+        removed = conn.execute(text(f"DELETE FROM product WHERE id IN ({duplicates})"), params).rowcount
+    if removed:
+        print(f"[DB] Удалено повторяющихся товаров (name, image_url): {removed}")
+    return removed
+
+
+def add_missing_indexes(engine: Engine) -> None:
+    """Создаёт индексы, объявленные в моделях после создания таблиц"""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def move_image_blobs(engine: Engine) -> int:
+    """Переносит старую колонку product.image_blob в таблицу product_image.
+
+    Возвращает количество перенесённых картинок.
+    """
+    columns = {c["name"] for c in sa_inspect(engine).get_columns("product")}
+    if "image_blob" not in columns:
+        return 0
+
+    with engine.connect() as conn:
+        ids = [
+            row[0]
+            for row in conn.execute(
+                text(
+                    "SELECT id FROM product WHERE image_blob IS NOT NULL AND id NOT IN "
+                    "(SELECT product_id FROM product_image WHERE variant = :variant)"
+                ),
+                {"variant": ORIGINAL_VARIANT},
+            )
+        ]
+    moved = 0
+    for start in range(0, len(ids), MIGRATION_BATCH):
+        with Session(engine) as session:
+            for product_id in ids[start:start + MIGRATION_BATCH]:
+                blob = session.exec(
+                    text("SELECT image_blob FROM product WHERE id = :id").bindparams(id=product_id)
+                ).scalar()
+                if blob:
+                    # ETag/тип/размер посчитает хук ProductImage
+                    save_product_image(session, product_id, bytes(blob))
+                    moved += 1
+            session.commit()
+    if moved:
+        print(f"[DB] Перенесено изображений в product_image: {moved}")
+
+    with engine.begin() as conn:
+        try:
+            conn.execute(text("ALTER TABLE product DROP COLUMN image_blob"))
+            print("[DB] Удалена колонка product.image_blob")
+        except Exception:
+            # Старый SQLite без DROP COLUMN — хотя бы освобождаем строки product от байтов
+            conn.execute(text("UPDATE product SET image_blob = NULL WHERE image_blob IS NOT NULL"))
+    return moved
+
+
+def fill_image_metadata(engine: Engine) -> int:
+    """Считает размер/формат/палитру и подпись для похожих у картинок, сохранённых
+    до появления этих колонок. Возвращает количество обработанных товаров.
+    """
+    if not analysis_supported():
+        return 0
+    with engine.connect() as conn:
+        ids = [
+            row[0]
+            for row in conn.execute(
+                text(
+                    "SELECT id FROM product WHERE image_etag IS NOT NULL AND (image_format IS NULL "
+                    "OR (image_format != :unknown AND id NOT IN (SELECT product_id FROM product_signature)))"
+                ),
+                {"unknown": UNKNOWN_FORMAT},
+            )
+        ]
+    filled = 0
+    for start in range(0, len(ids), MIGRATION_BATCH):
+        with engine.begin() as conn:
+            for product_id in ids[start:start + MIGRATION_BATCH]:
+                blob = conn.execute(
+                    text("SELECT blob FROM product_image WHERE product_id = :id AND variant = :variant"),
+                    {"id": product_id, "variant": ORIGINAL_VARIANT},
+                ).scalar()
+                if blob:
+                    store_image_analysis(conn, product_id, bytes(blob))
+                    filled += 1
+    if filled:
+        print(f"[DB] Посчитаны метаданные картинок: {filled}")
+    return filled
+
+
+def upgrade(engine: Engine) -> int:
+    """Применяет все шаги миграции; возвращает число перенесённых BLOB"""
+    SQLModel.metadata.create_all(engine)
+    add_missing_columns(engine)
+    # Сначала BLOB -> product_image: дедупликация оставляет товар, у которого картинка есть
+    moved = move_image_blobs(engine)
+    drop_duplicate_products(engine)
+    add_missing_indexes(engine)
+    fill_image_metadata(engine)
+    ensure_search_index(engine)
+    ensure_facets(engine)
+    return moved
+
+
+if __name__ == "__main__":
+    import sys
+    from sqlmodel import create_engine
+
+    if len(sys.argv) < 2:
+        print("Укажи путь к базе: python -m backend.migrations /path/to/catalog.db")
+        sys.exit(1)
+    for db_path in sys.argv[1:]:
+        print(f"[DB] Миграция {db_path}")
+        db_engine = create_engine(f"sqlite:///{db_path}", echo=False)
+        if upgrade(db_engine):
+            # Возвращаем место, которое занимали BLOB в таблице product
+            with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
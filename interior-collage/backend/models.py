@@ -1,14 +1,195 @@
+import hashlib
+from datetime import datetime, timezone
 from typing import Optional
-from sqlmodel import SQLModel, Field
+
+from sqlalchemy import BigInteger, Column, Index, event, func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import SQLModel, Field, Session, update
+
+from .palette import decode_thumbnail, image_metadata
+from .similar import compute_signature
+
+ORIGINAL_VARIANT = "original"
+CUTOUT_VARIANT = "cutout"  # RGBA без фона, его пишет skript/remove_bg.py --from-db
+IMAGE_VARIANTS = (ORIGINAL_VARIANT, CUTOUT_VARIANT)
+# Ключ advisory-блокировки Postgres, под которой выдаётся product_signature.seq
+SIGNATURE_SEQ_LOCK = 0x51675E9
+
+
+def compute_image_etag(data: bytes) -> str:
+    """Хэш содержимого картинки — используется как ETag и как версия в кэше копий"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def sniff_content_type(img_bytes: bytes) -> str:
+    """Определяет тип изображения по первым байтам"""
+    if img_bytes.startswith(b'\xff\xd8\xff'):
+        return "image/jpeg"
+    if img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return "image/png"
+    if img_bytes.startswith(b'GIF87a') or img_bytes.startswith(b'GIF89a'):
+        return "image/gif"
+    if img_bytes.startswith(b'RIFF') and b'WEBP' in img_bytes[:12]:
+        return "image/webp"
+    return "image/jpeg"  # по умолчанию
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class Product(SQLModel, table=True):
+    # Один товар = пара (название, картинка); на индекс опирается INSERT ... ON CONFLICT в import_excel
+    # Основной цвет в Lab — для фильтра по близости цвета (диапазоны по a, b, затем L)
+    __table_args__ = (
+        Index("ux_product_name_image_url", "name", "image_url", unique=True),
+        Index("ix_product_dominant_lab", "dominant_a", "dominant_b", "dominant_l"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    category: Optional[str] = None
+    category: Optional[str] = Field(default=None, index=True)
     image_url: str  # ссылка на jpg/png
-    image_blob: Optional[bytes] = None  # BLOB с содержимым изображения
     color: Optional[str] = None
     tags: Optional[str] = None  # через запятую
+    image_etag: Optional[str] = None  # ETag оригинала из product_image (копия для списков)
+    image_updated_at: Optional[datetime] = None  # когда последний раз менялся оригинал
+    cutout_etag: Optional[str] = None  # ETag вырезанной картинки (variant=cutout), если она есть
+    offer_id: Optional[str] = Field(default=None, index=True, unique=True)  # id предложения из выгрузки каталога
+    image_source_etag: Optional[str] = None  # ETag картинки на сайте-источнике (для условного GET)
+    image_source_modified: Optional[str] = None  # Last-Modified картинки на сайте-источнике
+    # Метаданные оригинала (backend/palette.py), считаются при записи картинки
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_format: Optional[str] = None  # jpeg, png, webp, ...; "unknown" — не удалось разобрать
+    image_has_alpha: Optional[bool] = None
+    palette: Optional[str] = None  # основные цвета через запятую, #rrggbb, первый — самый частый
+    dominant_l: Optional[float] = None
+    dominant_a: Optional[float] = None
+    dominant_b: Optional[float] = None
+
+
+class ProductSignature(SQLModel, table=True):
+    """Подпись картинки для поиска похожих (backend/similar.py)"""
+    __tablename__ = "product_signature"
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True, ondelete="CASCADE")
+    seq: int = Field(index=True)  # растёт с каждой записью — по нему индекс в памяти дочитывает новое
+    phash: int = Field(sa_column=Column(BigInteger, nullable=False))  # 64-битный pHash (со знаком)
+    vector: bytes  # float16 x SIGNATURE_DIM
+
+
+class ProductImage(SQLModel, table=True):
+    """Байты картинок хранятся отдельно от product, чтобы списки товаров их не читали"""
+    __tablename__ = "product_image"
+
+    product_id: int = Field(foreign_key="product.id", primary_key=True, ondelete="CASCADE")
+    variant: str = Field(default=ORIGINAL_VARIANT, primary_key=True)  # original, cutout, ...
+    etag: Optional[str] = None  # хэш blob, считается один раз при записи
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    updated_at: Optional[datetime] = None
+    # BLOB — последней колонкой: SQLite читает колонки до него, не трогая overflow-страницы
+    blob: bytes
+
+
+def store_image_analysis(connection, product_id: int, data: bytes) -> None:
+    """Метаданные и палитра -> колонки product, подпись для похожих -> product_signature"""
+    thumb = decode_thumbnail(data)
+    meta = image_metadata(thumb)
+    if meta:
+        connection.execute(update(Product).where(Product.id == product_id).values(**meta))
+    signature = compute_signature(thumb)
+    if signature is None:
+        return
+    phash, vector = signature
+    table = ProductSignature.__table__
+    if connection.dialect.name == "postgresql":
+        # seq = max + 1 безопасен, только пока писатели идут по одному и коммитятся в порядке seq:
+        # иначе два писателя получат один номер или индекс в памяти проскочит ещё не закоммиченный.
+        # В SQLite это даёт единственный писатель, в Postgres — блокировка до конца транзакции
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SIGNATURE_SEQ_LOCK})
+        insert = postgresql.insert
+    else:
+        insert = sqlite.insert
+    next_seq = select(func.coalesce(func.max(table.c.seq), 0) + 1).scalar_subquery()
+    stmt = insert(table).values(product_id=product_id, seq=next_seq, phash=phash, vector=vector)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["product_id"],
+            set_={"seq": next_seq, "phash": stmt.excluded.phash, "vector": stmt.excluded.vector},
+        )
+    )
+
+
+def _stamp_image(connection, target: ProductImage) -> None:
+    target.etag = compute_image_etag(target.blob)
+    target.content_type = sniff_content_type(target.blob)
+    target.size = len(target.blob)
+    target.updated_at = utcnow()
+    if target.variant == ORIGINAL_VARIANT:
+        connection.execute(
+            update(Product)
+            .where(Product.id == target.product_id)
+            .values(image_etag=target.etag, image_updated_at=target.updated_at)
+        )
+        store_image_analysis(connection, target.product_id, target.blob)
+    elif target.variant == CUTOUT_VARIANT:
+        connection.execute(update(Product).where(Product.id == target.product_id).values(cutout_etag=target.etag))
+
+
+@event.listens_for(ProductImage, "before_insert")
+def _image_before_insert(mapper, connection, target: ProductImage) -> None:
+    _stamp_image(connection, target)
+
+
+@event.listens_for(ProductImage, "before_update")
+def _image_before_update(mapper, connection, target: ProductImage) -> None:
+    if inspect(target).attrs.blob.history.has_changes():
+        _stamp_image(connection, target)
+
+
+def save_product_image(session: Session, product_id: int, data: bytes, variant: str = ORIGINAL_VARIANT) -> ProductImage:
+    """Создаёт или заменяет картинку товара (коммит — на вызывающей стороне)"""
+    image = session.get(ProductImage, (product_id, variant))
+    if image is None:
+        image = ProductImage(product_id=product_id, variant=variant, blob=data)
+    else:
+        image.blob = data
+    session.add(image)
+    return image
+
+
+class Collage(SQLModel, table=True):
+    """Сохранённый коллаж: сжатый снимок элементов на base_version + правки из collage_delta после него"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: Optional[str] = Field(default=None, index=True)
+    title: str = ""
+    version: int = 0  # номер последней применённой правки
+    base_version: int = 0  # версия, на которой снят снимок elements_json
+    created_at: datetime = Field(default_factory=utcnow)
+    updated_at: datetime = Field(default_factory=utcnow)
+    elements_json: bytes = b""  # JSON снимка, сжатый zlib (см. backend/collages.py)
+
+
+class CollageDelta(SQLModel, table=True):
+    """Одна правка коллажа (пакет операций add/move/transform/delete) — маленькая строка на автосохранение"""
+    __tablename__ = "collage_delta"
+
+    collage_id: int = Field(foreign_key="collage.id", primary_key=True, ondelete="CASCADE")
+    version: int = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=utcnow)
+    ops: str  # JSON-список операций
+
 
+class CatalogSnapshot(SQLModel, table=True):
+    """Готовый сжатый JSON всего каталога для /api/catalog/snapshot (backend/snapshot.py); строка одна"""
+    __tablename__ = "catalog_snapshot"
 
+    id: int = Field(default=1, primary_key=True)
+    version: Optional[int] = None  # catalog_meta.version, на которой снят снимок
+    etag: str = ""  # хэш несжатого JSON
+    size: int = 0  # размер несжатого JSON
+    built_at: datetime = Field(default_factory=utcnow)
+    gzip: bytes = b""
+    brotli: Optional[bytes] = None  # None — пакет brotli не установлен
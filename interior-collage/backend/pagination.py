@@ -0,0 +1,25 @@
+"""
+Курсоры для keyset-пагинации: клиент получает next_cursor и передаёт его обратно как есть.
+Внутри — JSON с ключом последней отданной строки (id и, при поиске, rank).
+"""
+
+import base64
+import json
+from typing import Any, Dict
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Разбирает курсор; ValueError, если он испорчен"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get("id"), int):
+        raise ValueError("Invalid cursor")
+    return data
@@ -0,0 +1,164 @@
+"""
+Метаданные картинки товара: размер, формат, прозрачность и палитра основных цветов.
+Считаются один раз при записи оригинала в product_image (хук в models.py)
+и хранятся в колонках product — фронтенду не нужно декодировать картинку ради размера,
+а /api/products фильтрует по близости цвета в пространстве Lab.
+"""
+
+import io
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # без Pillow метаданные картинок не считаются
+
+ANALYSIS_SIZE = 64  # палитру считаем по уменьшенной копии — этого хватает и это быстро
+PALETTE_SIZE = 5
+QUANT_BITS = 3  # 8 уровней на канал -> 512 корзин
+BACKGROUND_DISTANCE = 48  # пиксели ближе к цвету фона (сумма разностей RGB) в палитру не идут
+MERGE_DISTANCE = 12.0  # цвета палитры ближе этого ΔE сливаются в один (соседние корзины одного цвета)
+UNKNOWN_FORMAT = "unknown"  # картинку не удалось разобрать — чтобы не пытаться снова
+
+# sRGB (D65) -> XYZ
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]
+)
+_WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(..., 3) значения 0..255 -> CIE Lab (..., 3)"""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE_D65
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack(
+        [116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])],
+        axis=-1,
+    )
+
+
+def parse_hex_color(value: str) -> Tuple[int, int, int]:
+    """#rgb / #rrggbb (решётка необязательна) -> (r, g, b); ValueError, если не цвет"""
+    s = value.strip().lstrip("#")
+    if len(s) == 3:
+        s = "".join(ch * 2 for ch in s)
+    if len(s) != 6:
+        raise ValueError(f"Invalid color: {value}")
+    try:
+        return int(s[0:2], 16), int(s[2:4], 16), int(s[4:6], 16)
+    except ValueError:
+        raise ValueError(f"Invalid color: {value}") from None
+
+
+def hex_to_lab(value: str) -> Tuple[float, float, float]:
+    lab = rgb_to_lab(np.array(parse_hex_color(value)))
+    return float(lab[0]), float(lab[1]), float(lab[2])
+
+
+def _background_mask(pixels: np.ndarray) -> Optional[np.ndarray]:
+    """Пиксели цвета фона, если рамка картинки однотонная (типичный белый фон каталога)"""
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]]).astype(np.int32)
+    background = np.median(border, axis=0)
+    if np.mean(np.abs(border - background).sum(axis=1) < BACKGROUND_DISTANCE) < 0.9:
+        return None  # рамка пёстрая — фона нет, учитываем всё
+    return np.abs(pixels.astype(np.int32) - background).sum(axis=-1) < BACKGROUND_DISTANCE
+
+
+def dominant_palette(rgb: np.ndarray, weights: np.ndarray, size: int = PALETTE_SIZE) -> List[Tuple[np.ndarray, float]]:
+    """Квантование в корзины + средний цвет самых населённых корзин: [(rgb, доля), ...]"""
+    shift = 8 - QUANT_BITS
+    q = (rgb >> shift).astype(np.int64)
+    bins = (q[:, 0] << (2 * QUANT_BITS)) | (q[:, 1] << QUANT_BITS) | q[:, 2]
+    nbins = 1 << (3 * QUANT_BITS)
+    counts = np.bincount(bins, weights=weights, minlength=nbins)
+    total = counts.sum()
+    if total <= 0:
+        return []
+    sums = np.stack(
+        [np.bincount(bins, weights=weights * rgb[:, ch], minlength=nbins) for ch in range(3)], axis=1
+    )
+    top = np.argsort(counts)[::-1][: size * 4]
+    top = top[counts[top] > 0]
+    colors = sums[top] / counts[top, None]
+    labs = rgb_to_lab(colors)
+
+    # Жадно сливаем похожие: самая населённая корзина забирает вес соседей
+    chosen: List[int] = []
+    weight = counts[top].copy()
+    for i in range(len(top)):
+        if chosen:
+            distances = np.linalg.norm(labs[chosen] - labs[i], axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < MERGE_DISTANCE:
+                weight[chosen[nearest]] += weight[i]
+                continue
+        chosen.append(i)
+    order = sorted(chosen, key=lambda i: -weight[i])[:size]
+    return [(colors[i], float(weight[i] / total)) for i in order]
+
+
+class Thumbnail(NamedTuple):
+    """Картинка, декодированная один раз для всех расчётов при записи"""
+    width: int
+    height: int
+    format: str
+    has_alpha: bool
+    pixels: np.ndarray  # RGBA uint8, не больше ANALYSIS_SIZE по стороне
+    weights: np.ndarray  # вес пикселя 0..1: прозрачность и однотонный фон дают 0
+
+
+def decode_thumbnail(data: bytes) -> Optional[Thumbnail]:
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as src:
+            width, height = src.size
+            fmt = (src.format or UNKNOWN_FORMAT).lower()
+            has_alpha = src.mode in ("RGBA", "LA", "PA") or "transparency" in src.info
+            src.draft("RGB", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+            small = src.convert("RGBA")
+        small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    except Exception:
+        return None
+
+    pixels = np.asarray(small)
+    weights = pixels[..., 3].astype(np.float64) / 255.0  # полупрозрачное весит меньше
+    has_alpha = has_alpha and bool((pixels[..., 3] < 255).any())
+    if not has_alpha:
+        background = _background_mask(pixels[..., :3])
+        if background is not None and not background.all():
+            weights = np.where(background, 0.0, weights)
+    return Thumbnail(width, height, fmt, has_alpha, pixels, weights)
+
+
+def image_metadata(thumb: Optional[Thumbnail]) -> Dict[str, Any]:
+    """Значения колонок product; для неразборчивой картинки — только image_format"""
+    if thumb is None:
+        return {"image_format": UNKNOWN_FORMAT} if Image is not None else {}
+    palette = dominant_palette(thumb.pixels[..., :3].reshape(-1, 3).astype(np.int64), thumb.weights.reshape(-1))
+    meta: Dict[str, Any] = {
+        "image_width": thumb.width,
+        "image_height": thumb.height,
+        "image_format": thumb.format,
+        "image_has_alpha": thumb.has_alpha,
+        "palette": ",".join("#%02x%02x%02x" % tuple(int(round(v)) for v in color) for color, _ in palette) or None,
+        "dominant_l": None,
+        "dominant_a": None,
+        "dominant_b": None,
+    }
+    if palette:
+        lab = rgb_to_lab(palette[0][0])
+        meta["dominant_l"], meta["dominant_a"], meta["dominant_b"] = (round(float(v), 2) for v in lab)
+    return meta
+
+
+def analysis_supported() -> bool:
+    return Image is not None
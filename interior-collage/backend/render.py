@@ -0,0 +1,347 @@
+"""
+Серверный рендер коллажа в любом разрешении.
+
+Холст режется на полосы высотой RENDER_TILE, полоса — на квадраты RENDER_TILE x RENDER_TILE;
+каждый элемент рисуется только в те квадраты, которые задевает. В памяти одновременно —
+одна полоса результата и исходные картинки, уменьшенные до нужного размера.
+PNG пишется полосами по мере готовности, поэтому размер результата память не ограничивает.
+"""
+
+import asyncio
+import io
+import math
+import os
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+from sqlmodel import Session, select, tuple_
+
+try:
+    from PIL import Image, ImageColor  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # без Pillow серверный рендер недоступен
+    ImageColor = None
+
+from .db import PROJECT_ROOT, dispose_engines, read_engine
+from .models import IMAGE_VARIANTS, ORIGINAL_VARIANT, ProductImage
+
+RENDER_TILE = int(os.getenv("RENDER_TILE", "1024"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_MAX_PIXELS = int(os.getenv("RENDER_MAX_PIXELS", str(80_000_000)))
+RENDER_MAX_ELEMENTS = int(os.getenv("RENDER_MAX_ELEMENTS", "500"))
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", "92"))
+RENDER_DIR = Path(os.getenv("RENDER_DIR", str(PROJECT_ROOT / ".cache" / "render")))
+
+RENDER_FORMATS = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "jpg": "image/jpeg",
+}
+
+Point = Tuple[float, float]
+
+
+class RenderElement(BaseModel):
+    """Картинка товара на холсте — те же величины, что у группы Konva в редакторе"""
+    product_id: int
+    variant: str = ORIGINAL_VARIANT
+    x: float = 0
+    y: float = 0
+    width: float = Field(gt=0)  # размер картинки в координатах группы
+    height: float = Field(gt=0)
+    rotation: float = 0  # градусы, по часовой стрелке (как в Konva)
+    scale_x: float = 1
+    scale_y: float = 1
+    z: int = 0  # порядок слоёв: больше — выше
+    # Перспектива: углы tl, tr, br, bl в координатах группы (None — обычный прямоугольник)
+    corners: Optional[List[Point]] = None
+
+
+class RenderRequest(BaseModel):
+    width: float = Field(gt=0)  # размер сцены в координатах редактора
+    height: float = Field(gt=0)
+    pixel_ratio: float = Field(default=2, gt=0)  # как pixelRatio у stage.toDataURL
+    format: str = "png"
+    background: Optional[str] = None  # цвет фона; None — прозрачный (для JPEG — белый)
+    elements: List[RenderElement]
+
+
+def output_size(spec: RenderRequest) -> Tuple[int, int]:
+    return max(1, round(spec.width * spec.pixel_ratio)), max(1, round(spec.height * spec.pixel_ratio))
+
+
+def validate_request(spec: RenderRequest) -> None:
+    """Проверки до постановки в очередь; ValueError — ошибка клиента"""
+    if Image is None:
+        raise RuntimeError("Pillow не установлен — серверный рендер недоступен")
+    if spec.format.lower() not in RENDER_FORMATS:
+        raise ValueError(f"Unsupported format: {spec.format}")
+    out_w, out_h = output_size(spec)
+    if out_w * out_h > RENDER_MAX_PIXELS:
+        raise ValueError(f"Image too large: {out_w}x{out_h} (max {RENDER_MAX_PIXELS} pixels)")
+    if len(spec.elements) > RENDER_MAX_ELEMENTS:
+        raise ValueError(f"Too many elements: {len(spec.elements)} (max {RENDER_MAX_ELEMENTS})")
+    for element in spec.elements:
+        if element.variant not in IMAGE_VARIANTS:
+            raise ValueError(f"Unsupported variant: {element.variant}")
+        if element.corners is not None and len(element.corners) != 4:
+            raise ValueError("corners must contain 4 points (tl, tr, br, bl)")
+    if spec.background is not None:
+        ImageColor.getrgb(spec.background)  # ValueError на неизвестный цвет
+
+
+def missing_images(spec: RenderRequest) -> List[int]:
+    """id товаров, для которых в product_image нет нужной картинки (читаются только ключи)"""
+    keys = {(e.product_id, e.variant) for e in spec.elements}
+    if not keys:
+        return []
+    with Session(read_engine) as session:
+        rows = session.exec(
+            select(ProductImage.product_id, ProductImage.variant).where(
+                tuple_(ProductImage.product_id, ProductImage.variant).in_(list(keys))
+            )
+        ).all()
+    found = {(product_id, variant) for product_id, variant in rows}
+    return sorted({product_id for product_id, _ in keys - found})
+
+
+# --- Геометрия ---
+
+def element_corners(element: RenderElement, ratio: float) -> np.ndarray:
+    """Углы элемента на выходной картинке: масштаб -> поворот -> сдвиг группы -> pixel_ratio"""
+    local = element.corners or [
+        (0, 0),
+        (element.width, 0),
+        (element.width, element.height),
+        (0, element.height),
+    ]
+    pts = np.asarray(local, dtype=np.float64) * (element.scale_x, element.scale_y)
+    angle = math.radians(element.rotation)
+    cos, sin = math.cos(angle), math.sin(angle)
+    rotated = pts @ np.array([[cos, sin], [-sin, cos]])
+    return (rotated + (element.x, element.y)) * ratio
+
+
+def perspective_coeffs(dst: np.ndarray, src: np.ndarray) -> np.ndarray:
+    """Гомография dst -> src (8 коэффициентов для Image.transform(PERSPECTIVE))"""
+    a = np.zeros((8, 8))
+    b = np.zeros(8)
+    for i, ((x, y), (u, v)) in enumerate(zip(dst, src)):
+        a[2 * i] = (x, y, 1, 0, 0, 0, -u * x, -u * y)
+        a[2 * i + 1] = (0, 0, 0, x, y, 1, -v * x, -v * y)
+        b[2 * i], b[2 * i + 1] = u, v
+    return np.linalg.solve(a, b)
+
+
+def shift_coeffs(coeffs: np.ndarray, dx: float, dy: float) -> Tuple[float, ...]:
+    """Та же гомография для квадрата, начинающегося в (dx, dy) выходной картинки"""
+    a, b, c, d, e, f, g, h = coeffs
+    k = g * dx + h * dy + 1
+    shifted = (a, b, a * dx + b * dy + c, d, e, d * dx + e * dy + f, g, h)
+    return tuple(float(v) / k for v in shifted)
+
+
+class _Placed:
+    """Элемент, подготовленный к отрисовке: картинка, гомография и границы на холсте"""
+
+    def __init__(self, image, coeffs: np.ndarray, bbox: Tuple[int, int, int, int]):
+        self.image = image
+        self.coeffs = coeffs
+        self.bbox = bbox
+
+
+def _load_blob(session: Session, product_id: int, variant: str) -> Optional[bytes]:
+    return session.exec(
+        select(ProductImage.blob).where(ProductImage.product_id == product_id, ProductImage.variant == variant)
+    ).first()
+
+
+def _decode(blob: bytes, target: int):
+    """Исходник, уменьшенный до размера на холсте: меньше памяти и нет муара при сильном уменьшении"""
+    with Image.open(io.BytesIO(blob)) as src:
+        src.seek(0)
+        src.draft("RGB", (target, target))  # JPEG декодируется сразу в уменьшенном виде
+        image = src.convert("RGBA")
+    if max(image.size) > target:
+        image.thumbnail((target, target), Image.LANCZOS)
+    return image
+
+
+def _place_elements(spec: RenderRequest, out_w: int, out_h: int) -> List["_Placed"]:
+    # Сначала геометрия (без картинок): какие элементы видны и какого размера нужны исходники
+    visible: List[Tuple[np.ndarray, Tuple[int, int, int, int], Tuple[int, str, int]]] = []
+    targets: Dict[Tuple[int, str], Set[int]] = {}
+    for element in sorted(spec.elements, key=lambda e: e.z):  # sorted устойчив: при равных z — порядок запроса
+        dst = element_corners(element, spec.pixel_ratio)
+        left, top = np.floor(dst.min(axis=0)).astype(int)
+        right, bottom = np.ceil(dst.max(axis=0)).astype(int)
+        left, top, right, bottom = max(left, 0), max(top, 0), min(right, out_w), min(bottom, out_h)
+        if left >= right or top >= bottom:
+            continue  # целиком за пределами холста
+        edges = np.linalg.norm(dst - np.roll(dst, -1, axis=0), axis=1)
+        target = max(1, int(math.ceil(max(edges))))
+        visible.append((dst, (left, top, right, bottom), (element.product_id, element.variant, target)))
+        targets.setdefault((element.product_id, element.variant), set()).add(target)
+
+    # Затем картинки по одной: blob читается, уменьшается и сразу отпускается,
+    # в памяти остаются только копии размером с холст
+    decoded: Dict[Tuple[int, str, int], object] = {}
+    with Session(read_engine) as session:
+        for (product_id, variant), sizes in targets.items():
+            blob = _load_blob(session, product_id, variant)
+            if not blob:
+                continue
+            for target in sizes:
+                decoded[(product_id, variant, target)] = _decode(blob, target)
+            del blob
+
+    placed: List[_Placed] = []
+    for dst, bbox, key in visible:
+        image = decoded.get(key)
+        if image is None:
+            continue
+        w, h = image.size
+        src_corners = np.array([(0, 0), (w, 0), (w, h), (0, h)], dtype=np.float64)
+        try:
+            coeffs = perspective_coeffs(dst, src_corners)
+        except np.linalg.LinAlgError:
+            continue  # вырожденный четырёхугольник — рисовать нечего
+        placed.append(_Placed(image, coeffs, bbox))
+    return placed
+
+
+def render_band(placed: List[_Placed], background, out_w: int, top: int, bottom: int):
+    """Полоса [top, bottom) выходной картинки, собранная из квадратов RENDER_TILE"""
+    band = Image.new("RGBA", (out_w, bottom - top), background)
+    for tile_left in range(0, out_w, RENDER_TILE):
+        tile_right = min(tile_left + RENDER_TILE, out_w)
+        items = [
+            p for p in placed
+            if p.bbox[0] < tile_right and p.bbox[2] > tile_left and p.bbox[1] < bottom and p.bbox[3] > top
+        ]
+        if not items:
+            continue
+        size = (tile_right - tile_left, bottom - top)
+        tile = band.crop((tile_left, 0, tile_right, bottom - top))
+        for p in items:
+            warped = p.image.transform(
+                size, Image.PERSPECTIVE, shift_coeffs(p.coeffs, tile_left, top), Image.BICUBIC
+            )
+            tile.alpha_composite(warped)
+        band.paste(tile, (tile_left, 0))
+    return band
+
+
+# --- Потоковая запись PNG ---
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+class PngStreamWriter:
+    """PNG, который пишется полосами: строки сжимаются одним zlib-потоком и уходят в файл
+    кусками IDAT, вся картинка целиком в памяти не собирается"""
+
+    IDAT_SIZE = 256 * 1024
+
+    def __init__(self, f: BinaryIO, width: int, height: int, mode: str = "RGBA", level: int = 6):
+        self.f = f
+        self.bpp = 4 if mode == "RGBA" else 3
+        self.compressor = zlib.compressobj(level)
+        self.pending = bytearray()
+        color_type = 6 if mode == "RGBA" else 2
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+
+    def write_rows(self, pixels: np.ndarray) -> None:
+        """pixels — (строки, ширина, каналы) uint8; каждая строка кодируется фильтром Sub"""
+        rows = pixels.reshape(pixels.shape[0], -1)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1  # тип фильтра Sub: разность с пикселем слева
+        filtered[:, 1:self.bpp + 1] = rows[:, :self.bpp]
+        np.subtract(rows[:, self.bpp:], rows[:, :-self.bpp], out=filtered[:, self.bpp + 1:])
+        self.pending += self.compressor.compress(filtered.tobytes())
+        self._flush(self.IDAT_SIZE)
+
+    def close(self) -> None:
+        self.pending += self.compressor.flush()
+        self._flush(1)
+        self.f.write(_png_chunk(b"IEND", b""))
+
+    def _flush(self, threshold: int) -> None:
+        if len(self.pending) >= threshold:
+            self.f.write(_png_chunk(b"IDAT", bytes(self.pending)))
+            self.pending.clear()
+
+
+def render_to_file(spec_data: dict, path: str) -> None:
+    """Рендер в файл (выполняется в процессе пула)"""
+    spec = RenderRequest.model_validate(spec_data)
+    fmt = spec.format.lower()
+    out_w, out_h = output_size(spec)
+    if spec.background is not None:
+        background = ImageColor.getcolor(spec.background, "RGBA")
+    else:
+        background = (255, 255, 255, 0) if fmt == "png" else (255, 255, 255, 255)
+    placed = _place_elements(spec, out_w, out_h)
+
+    bands = ((top, min(top + RENDER_TILE, out_h)) for top in range(0, out_h, RENDER_TILE))
+    if fmt == "png":
+        mode = "RGBA" if background[3] < 255 else "RGB"
+        with open(path, "wb") as f:
+            writer = PngStreamWriter(f, out_w, out_h, mode)
+            for top, bottom in bands:
+                band = render_band(placed, background, out_w, top, bottom)
+                writer.write_rows(np.asarray(band if mode == "RGBA" else band.convert("RGB")))
+            writer.close()
+    else:
+        # JPEG-кодировщику Pillow нужна вся картинка: собираем RGB (3 байта на пиксель)
+        result = Image.new("RGB", (out_w, out_h))
+        for top, bottom in bands:
+            band = render_band(placed, background, out_w, top, bottom)
+            result.paste(band.convert("RGB"), (0, top))
+        result.save(path, format="JPEG", quality=RENDER_JPEG_QUALITY, optimize=True)
+
+
+# --- Пул процессов ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _init_worker() -> None:
+    dispose_engines()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, RENDER_WORKERS), initializer=_init_worker)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def render_collage(spec: RenderRequest) -> Path:
+    """Рендерит коллаж в пуле процессов и возвращает путь к временному файлу (удаляет вызывающий)"""
+    RENDER_DIR.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(dir=RENDER_DIR, suffix=f".{spec.format.lower()}")
+    os.close(fd)
+    path = Path(name)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(get_pool(), render_to_file, spec.model_dump(), name)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
@@ -0,0 +1,99 @@
+"""
+Полнотекстовый индекс товаров (SQLite FTS5) по name, tags, category, color.
+
+Индекс без собственного содержимого (content=''), хранит только rowid = product.id.
+Синхронизируется триггерами на таблице product, поэтому его поддерживают все,
+кто пишет в базу: API, import_excel, build_catalog и прямой SQL.
+Токенизатор unicode61 сам приводит кириллицу к нижнему регистру;
+«ё» заменяем на «е» и при индексации, и в запросе.
+"""
+
+import re
+from typing import Optional
+
+from sqlalchemy import Float, Integer
+from sqlalchemy.engine import Engine
+from sqlmodel import text
+
+FTS_TABLE = "product_fts"
+FTS_COLUMNS = ("name", "tags", "category", "color")
+# Веса колонок для bm25: совпадение в названии важнее, чем в цвете
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+
+def _normalized(expr: str) -> str:
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _values(prefix: str) -> str:
+    return ", ".join(_normalized(f"{prefix}.{c}") for c in FTS_COLUMNS)
+
+
+_COLUMNS_SQL = ", ".join(FTS_COLUMNS)
+
+_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_COLUMNS_SQL}, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS_SQL}) VALUES (new.id, {_values('new')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS_SQL}) VALUES ('delete', old.id, {_values('old')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF {_COLUMNS_SQL} ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS_SQL}) VALUES ('delete', old.id, {_values('old')});
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS_SQL}) VALUES (new.id, {_values('new')});
+    END""",
+]
+
+
+def fts_supported(engine: Engine) -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """Создаёт FTS-индекс и триггеры; при первом создании заполняет его из product"""
+    if not fts_supported(engine):
+        return
+    with engine.begin() as conn:
+        existed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first()
+        for ddl in _DDL:
+            conn.exec_driver_sql(ddl)
+        if not existed:
+            rebuild_search_index(conn)
+
+
+def rebuild_search_index(conn) -> None:
+    """Полностью перестраивает индекс (после массовой записи в обход триггеров)"""
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+    conn.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS_SQL}) SELECT id, {_values('product')} FROM product"
+    )
+    count = conn.exec_driver_sql("SELECT COUNT(*) FROM product").scalar()
+    print(f"[DB] Поисковый индекс построен: {count} товаров")
+
+
+def build_match_query(search: str) -> Optional[str]:
+    """Превращает ввод пользователя в запрос FTS5: каждое слово — как префикс, все слова обязательны"""
+    normalized = search.lower().replace("ё", "е")
+    tokens = re.findall(r"\w+", normalized)
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def search_subquery(match_query: str):
+    """Подзапрос (rowid, rank) для JOIN с product; меньший rank — лучшее совпадение"""
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    return (
+        text(
+            f"SELECT rowid AS product_id, bm25({FTS_TABLE}, {weights}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match_query"
+        )
+        .bindparams(match_query=match_query)
+        .columns(product_id=Integer, rank=Float)
+        .subquery("fts")
+    )
@@ -0,0 +1,190 @@
+"""
+Поиск похожих товаров по картинке.
+
+Для каждой картинки при записи (хук в models.py) считается подпись:
+- перцептивный хэш (64 бита, DCT 32x32) — общая форма и светотень;
+- компактный вектор SIGNATURE_DIM: гистограмма цветов в Lab, направления границ и силуэт
+  (фон и прозрачность не учитываются).
+Подписи лежат в таблице product_signature; в памяти процесса они собраны в сплошные
+матрицы NumPy и дочитываются по seq — новые товары появляются в поиске без перестройки.
+Полный перебор 100k x SIGNATURE_DIM float32 — единицы миллисекунд, отдельный LSH не нужен.
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # без Pillow подписи не считаются (decode_thumbnail вернёт None)
+
+from .palette import Thumbnail, rgb_to_lab
+
+COLOR_BINS = (2, 4, 4)  # L, a, b
+ORIENTATION_BINS = 8
+SHAPE_GRID = 4  # силуэт: SHAPE_GRID x SHAPE_GRID ячеек
+SIGNATURE_DIM = int(np.prod(COLOR_BINS)) + ORIENTATION_BINS + SHAPE_GRID * SHAPE_GRID
+# Вклад частей вектора в косинус (сумма 1) и вклад хэша в итоговую оценку
+BLOCK_WEIGHTS = (0.6, 0.2, 0.2)
+HASH_WEIGHT = 0.3
+HASH_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT = _dct_matrix(HASH_SIZE)
+
+
+def _resize(values: np.ndarray, size: int) -> np.ndarray:
+    return np.asarray(Image.fromarray(values.astype(np.float32)).resize((size, size), Image.BILINEAR))
+
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """pHash: знаки низких частот DCT относительно медианы -> 64 бита"""
+    coeffs = _DCT @ _resize(gray, HASH_SIZE) @ _DCT.T
+    low = coeffs[:8, :8].reshape(-1)
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _unit(v: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(v)
+    return v / norm if norm > 0 else v
+
+
+def compute_signature(thumb: Optional[Thumbnail]) -> Optional[Tuple[int, bytes]]:
+    """(хэш как знаковое 64-битное число, вектор float16) или None, если картинка пустая"""
+    if thumb is None or thumb.weights.sum() <= 0:
+        return None
+    rgb = thumb.pixels[..., :3].astype(np.float64)
+    alpha = thumb.pixels[..., 3:4].astype(np.float64) / 255.0
+    # Прозрачное — как белый фон каталога, чтобы хэш не зависел от того, вырезан товар или нет
+    flat = rgb * alpha + 255.0 * (1 - alpha)
+    lab = rgb_to_lab(flat)
+    weights = thumb.weights
+
+    # Цвет: совместная гистограмма L/a/b по пикселям товара, корень (Хеллингер) для косинуса
+    l_bin = np.clip((lab[..., 0] / 100 * COLOR_BINS[0]).astype(int), 0, COLOR_BINS[0] - 1)
+    a_bin = np.clip(((lab[..., 1] + 60) / 120 * COLOR_BINS[1]).astype(int), 0, COLOR_BINS[1] - 1)
+    b_bin = np.clip(((lab[..., 2] + 60) / 120 * COLOR_BINS[2]).astype(int), 0, COLOR_BINS[2] - 1)
+    color_index = (l_bin * COLOR_BINS[1] + a_bin) * COLOR_BINS[2] + b_bin
+    color = np.sqrt(np.bincount(color_index.reshape(-1), weights=weights.reshape(-1), minlength=int(np.prod(COLOR_BINS))))
+
+    # Фактура: направления градиента яркости, взвешенные силой и принадлежностью товару
+    gray = lab[..., 0] / 100
+    gy, gx = np.gradient(gray)
+    magnitude = np.hypot(gx, gy) * weights
+    angle = np.mod(np.arctan2(gy, gx), np.pi)
+    orientation = np.bincount(
+        np.minimum((angle / np.pi * ORIENTATION_BINS).astype(int), ORIENTATION_BINS - 1).reshape(-1),
+        weights=magnitude.reshape(-1),
+        minlength=ORIENTATION_BINS,
+    )
+
+    # Силуэт: доля товара в ячейках сетки
+    shape = _resize(weights, SHAPE_GRID).reshape(-1)
+
+    blocks = [_unit(b) * np.sqrt(w) for b, w in zip((color, orientation, shape), BLOCK_WEIGHTS)]
+    vector = _unit(np.concatenate(blocks)).astype(np.float16)
+    phash = np.array([perceptual_hash(gray)], dtype=np.uint64).view(np.int64)[0]
+    return int(phash), vector.tobytes()
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class SimilarityIndex:
+    """Подписи всех товаров в сплошных массивах; дочитывает новые строки product_signature по seq"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._vectors = np.empty((0, SIGNATURE_DIM), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._rows: Dict[int, int] = {}
+        self._size = 0
+        self._last_seq = 0
+
+    def _reserve(self, extra: int) -> None:
+        need = self._size + extra
+        if need <= len(self._ids):
+            return
+        capacity = max(need, 2 * len(self._ids), 1024)
+        self._ids = np.resize(self._ids, capacity)
+        self._hashes = np.resize(self._hashes, capacity)
+        self._alive = np.resize(self._alive, capacity)
+        vectors = np.zeros((capacity, SIGNATURE_DIM), dtype=np.float32)
+        vectors[: self._size] = self._vectors[: self._size]
+        self._vectors = vectors
+
+    def refresh(self, connection) -> int:
+        """Дочитывает подписи, записанные после прошлого раза; возвращает их количество"""
+        rows = connection.execute(
+            text(
+                "SELECT product_id, seq, phash, vector FROM product_signature WHERE seq > :seq ORDER BY seq"
+            ),
+            {"seq": self._last_seq},
+        ).all()
+        if not rows:
+            return 0
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        hashes = np.array([r[2] for r in rows], dtype=np.int64).view(np.uint64)
+        vectors = np.frombuffer(b"".join(bytes(r[3]) for r in rows), dtype=np.float16).reshape(-1, SIGNATURE_DIM)
+
+        self._reserve(len(rows))
+        positions = np.empty(len(rows), dtype=np.int64)
+        for i, product_id in enumerate(ids.tolist()):
+            pos = self._rows.get(product_id)
+            if pos is None:
+                pos = self._rows[product_id] = self._size
+                self._size += 1
+            positions[i] = pos
+        # Если товар встретился дважды, побеждает последняя запись (строки идут по seq)
+        self._ids[positions] = ids
+        self._hashes[positions] = hashes
+        self._vectors[positions] = vectors
+        self._alive[positions] = True
+        self._last_seq = int(rows[-1][1])
+        return len(rows)
+
+    def discard(self, product_id: int) -> None:
+        with self._lock:
+            pos = self._rows.get(product_id)
+            if pos is not None:
+                self._alive[pos] = False
+
+    def query(self, connection, product_id: int, k: int) -> Optional[List[Tuple[int, float]]]:
+        """k самых похожих [(product_id, оценка 0..1)]; None — у товара ещё нет подписи"""
+        with self._lock:
+            self.refresh(connection)
+            row = self._rows.get(product_id)
+            if row is None or not self._alive[row]:
+                return None
+            n = self._size
+            similarity = self._vectors[:n] @ self._vectors[row]
+            hamming = _popcount(self._hashes[:n] ^ self._hashes[row]).astype(np.float32)
+            score = (1 - HASH_WEIGHT) * similarity + HASH_WEIGHT * (1 - hamming / 64)
+            score[~self._alive[:n]] = -np.inf
+            score[row] = -np.inf
+            k = min(k, int(np.isfinite(score).sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-score, k - 1)[:k]
+            top = top[np.argsort(-score[top])]
+            return [(int(self._ids[i]), float(score[i])) for i in top]
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,205 @@
+"""
+Снимок всего каталога для /api/catalog/snapshot: все товары (без картинок) одним JSON.
+
+Каталог — несколько тысяч строк и меняется редко, поэтому клиент загружает его один раз,
+фильтрует у себя и только перепроверяет по ETag (304 без тела).
+Снимок собирается после записи (фоновая задача API, import_excel, build_catalog), сразу
+сжимается gzip и brotli и лежит в таблице catalog_snapshot — запрос не сериализует и не
+сжимает ничего. ETag — хэш несжатого JSON: пересборка без изменений данных его не меняет.
+
+Свежесть проверяется по catalog_meta.version (её ведут триггеры фасетов на product):
+если в базу записали в обход API, первый запрос запускает пересборку в фоне,
+а до её окончания отдаётся прежний снимок.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover
+    brotli = None  # без пакета brotli снимок хранится и отдаётся только в gzip
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from .db import engine, read_engine
+from .facets import catalog_version, facets_supported
+from .models import CatalogSnapshot, Product, utcnow
+
+SNAPSHOT_GZIP_LEVEL = int(os.getenv("SNAPSHOT_GZIP_LEVEL", "9"))
+SNAPSHOT_BROTLI_QUALITY = int(os.getenv("SNAPSHOT_BROTLI_QUALITY", "9"))  # 11 — в разы медленнее
+
+# Поля товара в снимке — те же, что в ProductResponse; пустые значения не пишутся
+SNAPSHOT_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.category,
+    Product.image_url,
+    Product.color,
+    Product.tags,
+    Product.image_etag,
+    Product.cutout_etag,
+    Product.image_width,
+    Product.image_height,
+    Product.image_format,
+    Product.image_has_alpha,
+    Product.palette,
+)
+
+ENCODING_SUFFIX = {"br": ".br", "gzip": ".gz", None: ""}
+
+
+class Snapshot(NamedTuple):
+    version: Optional[int]  # catalog_meta.version, на которой снят снимок (None — без триггеров)
+    etag: str  # хэш несжатого JSON
+    size: int
+    gzip: bytes
+    brotli: Optional[bytes]
+
+    def body(self, encoding: Optional[str]) -> bytes:
+        if encoding == "br":
+            return self.brotli
+        if encoding == "gzip":
+            return self.gzip
+        return gzip.decompress(self.gzip)  # клиент без сжатия — редкость, отдельно не храним
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """У каждого сжатого представления свой ETag, хэш содержимого в нём общий"""
+        return self.etag + ENCODING_SUFFIX[encoding]
+
+
+def choose_encoding(accept_encoding: Optional[str], has_brotli: bool) -> Optional[str]:
+    """br, gzip или None по заголовку Accept-Encoding (q=0 — кодировка запрещена)"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        accepted.add(name.strip())
+    if has_brotli and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _current_version(session: Session) -> Optional[int]:
+    return catalog_version(session) if facets_supported(session.get_bind()) else None
+
+
+def build_snapshot(session: Session) -> Snapshot:
+    """Читает каталог (версия и строки — в одной транзакции) и сжимает его"""
+    version = _current_version(session)
+    columns = [c.key for c in SNAPSHOT_COLUMNS]
+    items: List[Dict[str, Any]] = [
+        {k: v for k, v in zip(columns, row) if v is not None}
+        for row in session.exec(select(*SNAPSHOT_COLUMNS).order_by(Product.id)).all()
+    ]
+    raw = json.dumps({"total": len(items), "items": items}, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return Snapshot(
+        version=version,
+        etag=hashlib.sha256(raw).hexdigest()[:32],
+        size=len(raw),
+        gzip=gzip.compress(raw, SNAPSHOT_GZIP_LEVEL, mtime=0),
+        brotli=brotli.compress(raw, quality=SNAPSHOT_BROTLI_QUALITY) if brotli is not None else None,
+    )
+
+
+def store_snapshot(write_engine: Engine, snapshot: Snapshot) -> bool:
+    """Сохраняет снимок, если в базе не лежит более новый; True — записан"""
+    with Session(write_engine) as session:
+        row = session.get(CatalogSnapshot, 1)
+        if row is None:
+            row = CatalogSnapshot(id=1)
+        elif None not in (row.version, snapshot.version) and row.version > snapshot.version:
+            return False
+        row.version = snapshot.version
+        row.etag = snapshot.etag
+        row.size = snapshot.size
+        row.built_at = utcnow()
+        row.gzip = snapshot.gzip
+        row.brotli = snapshot.brotli
+        session.add(row)
+        session.commit()
+    return True
+
+
+def write_catalog_snapshot(source_engine: Engine, write_engine: Optional[Engine] = None) -> Snapshot:
+    """Пересобирает снимок; для скриптов импорта, которые пишут в базу в обход API"""
+    with Session(source_engine) as session:
+        snapshot = build_snapshot(session)
+    store_snapshot(write_engine or source_engine, snapshot)
+    return snapshot
+
+
+def _stored_row(session: Session):
+    return session.exec(select(CatalogSnapshot.version, CatalogSnapshot.etag).where(CatalogSnapshot.id == 1)).first()
+
+
+class SnapshotCache:
+    """Снимок в памяти процесса; на запрос — два чтения по ключу (версия каталога и ETag снимка)"""
+
+    def __init__(self) -> None:
+        self._snapshot: Optional[Snapshot] = None
+        self._build_lock = threading.Lock()
+        self._dirty = False
+
+    def _load(self, session: Session) -> Snapshot:
+        row = session.get(CatalogSnapshot, 1)
+        snapshot = Snapshot(row.version, row.etag, row.size, row.gzip, row.brotli)
+        self._snapshot = snapshot
+        return snapshot
+
+    def get(self, session: Session) -> Snapshot:
+        version = _current_version(session)
+        stored = _stored_row(session)
+        if stored is None:
+            # Снимка ещё нет: собирает один поток, остальные ждут его
+            with self._build_lock:
+                cached = self._snapshot
+                if cached is not None:
+                    return cached
+                snapshot = build_snapshot(session)
+                store_snapshot(engine, snapshot)
+                self._snapshot = snapshot
+                return snapshot
+        if version is not None and stored.version != version:
+            # Снимок отстал от базы: пересобираем в фоне, а пока отдаём прежний
+            self._refresh_in_background()
+        cached = self._snapshot
+        if cached is not None and cached.etag == stored.etag:
+            return cached
+        return self._load(session)
+
+    def _refresh_in_background(self) -> None:
+        if not self._build_lock.locked():
+            threading.Thread(target=self.refresh, name="catalog-snapshot", daemon=True).start()
+
+    def refresh(self) -> None:
+        """Пересборка после записи (фоновая задача). Записи во время сборки не теряются:
+        после неё сборка повторяется, а не запускается параллельно"""
+        self._dirty = True
+        while self._dirty and self._build_lock.acquire(blocking=False):
+            try:
+                self._dirty = False
+                with Session(read_engine) as session:
+                    version = _current_version(session)
+                    stored = _stored_row(session)
+                    if version is not None and stored is not None and stored.version == version:
+                        continue
+                    snapshot = build_snapshot(session)
+                if store_snapshot(engine, snapshot):
+                    self._snapshot = snapshot
+            except Exception as e:
+                print(f"[SNAPSHOT] Не удалось пересобрать снимок каталога: {e}")
+            finally:
+                self._build_lock.release()
+
+
+catalog_snapshot = SnapshotCache()
@@ -66,12 +66,77 @@ btnExport.addEventListener('click', () => {
   }
   window.canvasTransformer.nodes([]);
   window.canvasLayer.draw();
-  const dataURL = window.canvasStage.toDataURL({ pixelRatio: 2 });
+
+  // Коллаж только из картинок каталога рендерит сервер (любое разрешение, не грузит вкладку);
+  // после ластика/выделения картинки живут только в браузере — экспортируем как раньше
+  const spec = collectRenderSpec(EXPORT_PIXEL_RATIO);
+  if (!spec) {
+    downloadURL(window.canvasStage.toDataURL({ pixelRatio: EXPORT_PIXEL_RATIO }), 'collage.png');
+    return;
+  }
+  API.renderCollage(spec)
+    .then(blob => {
+      const url = URL.createObjectURL(blob);
+      downloadURL(url, 'collage.png');
+      setTimeout(() => URL.revokeObjectURL(url), 1000);
+    })
+    .catch(err => {
+      console.warn('Серверный экспорт не удался, рендерим в браузере:', err);
+      downloadURL(window.canvasStage.toDataURL({ pixelRatio: EXPORT_PIXEL_RATIO }), 'collage.png');
+    });
+});
+
+const EXPORT_PIXEL_RATIO = 2;
+
+function downloadURL(url, filename) {
   const a = document.createElement('a');
-  a.href = dataURL;
-  a.download = 'collage.png';
+  a.href = url;
+  a.download = filename;
   a.click();
-});
+}
+
+// Описание холста для /api/render; null — есть что-то, чего сервер нарисовать не может
+function collectRenderSpec(pixelRatio) {
+  if (window.eraserLayer && window.eraserLayer.getChildren().length > 0) return null;
+
+  const elements = [];
+  for (const group of getImageGroups()) {
+    if (!group.visible()) continue;
+    const image = group.findOne('.normal-image');
+    const src = image && image.image() && image.image().src;
+    if (!src) return null;
+
+    const url = new URL(src, window.location.href);
+    const match = url.pathname.match(/^\/api\/image\/(\d+)$/);
+    if (url.origin !== window.location.origin || !match) return null;
+
+    const element = {
+      product_id: Number(match[1]),
+      variant: url.searchParams.get('variant') || 'original',
+      x: group.x(),
+      y: group.y(),
+      width: image.width(),
+      height: image.height(),
+      rotation: group.rotation(),
+      scale_x: group.scaleX(),
+      scale_y: group.scaleY(),
+      z: group.zIndex(),
+    };
+    const perspective = group.findOne('.perspective-image');
+    if (perspective && perspective.visible() && perspective._perspectiveData) {
+      element.corners = perspective._perspectiveData.corners.map(p => [p.x, p.y]);
+    }
+    elements.push(element);
+  }
+
+  return {
+    width: window.canvasStage.width(),
+    height: window.canvasStage.height(),
+    pixel_ratio: pixelRatio,
+    format: 'png',
+    elements: elements,
+  };
+}
 
 // Кнопка "Удалить выбранное"
 btnDelete.addEventListener('click', () => {
@@ -4,7 +4,7 @@
 // ========================================
 
 const API = {
-  // Получить список товаров с фильтрами
+  // Получить страницу товаров с фильтрами: { items, next_cursor, total }
   products: (params = {}) => {
     const q = new URLSearchParams(params).toString();
     return fetch(`/api/products?${q}`).then(r => r.json());
@@ -12,5 +12,38 @@ const API = {
   
   // Получить список категорий
   categories: () => fetch(`/api/categories`).then(r => r.json()),
+
+  // Весь каталог одним JSON: { etag, total, items }. Ответ с Cache-Control: no-cache —
+  // браузер сам перепроверяет его по ETag, и без изменений приходит 304 без тела
+  catalogSnapshot: () => fetch(`/api/catalog/snapshot`).then(r => {
+    if (!r.ok) throw new Error(`catalog snapshot failed: ${r.status}`);
+    return r.json().then(body => ({ etag: r.headers.get('ETag'), ...body }));
+  }),
+
+  // Отрендерить коллаж на сервере: { width, height, pixel_ratio, format, elements } -> Blob
+  renderCollage: (spec) => fetch(`/api/render`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(spec),
+  }).then(r => {
+    if (!r.ok) throw new Error(`render failed: ${r.status}`);
+    return r.blob();
+  }),
+
+  // Коллажи: создать целиком, потом сохранять только правки поверх версии
+  createCollage: (collage) => fetch(`/api/collages`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(collage),
+  }).then(r => r.json()),
+
+  getCollage: (id) => fetch(`/api/collages/${id}`).then(r => r.json()),
+
+  // ops: [{ op: 'add'|'move'|'transform'|'delete', id, ... }]; при 409 — перечитать коллаж
+  saveCollageOps: (id, baseVersion, ops) => fetch(`/api/collages/${id}`, {
+    method: 'PATCH',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ base_version: baseVersion, ops }),
+  }).then(r => r.json().then(body => ({ status: r.status, body }))),
 };
 
@@ -7,9 +7,68 @@ const searchEl = document.getElementById('search');
 const categoryEl = document.getElementById('category');
 const productsEl = document.getElementById('products');
 
-// Отображение товаров в каталоге
-function renderProducts(items) {
-  productsEl.innerHTML = '';
+// Ширина миниатюры в каталоге: сервер отдаёт уменьшенную копию вместо оригинала
+const THUMB_WIDTH = 256;
+
+// Ссылка на картинку товара; с версией (image_etag) браузер кэширует её навсегда
+function productImageUrl(p, extraParams = {}) {
+  const params = new URLSearchParams(extraParams);
+  if (p.image_etag) params.set('v', p.image_etag);
+  const q = params.toString();
+  return q ? `/api/image/${p.id}?${q}` : `/api/image/${p.id}`;
+}
+
+// Картинка без фона, если сервер её уже построил (remove_bg.py --from-db), иначе оригинал
+function productCanvasImageUrl(p) {
+  if (!p.cutout_etag) return productImageUrl(p);
+  return `/api/image/${p.id}?variant=cutout&v=${encodeURIComponent(p.cutout_etag)}`;
+}
+
+// Размер страницы каталога и состояние бесконечной прокрутки
+const PAGE_SIZE = 100;
+let nextCursor = null;
+let loadingPage = false;
+let reloadToken = 0;
+
+// Снимок всего каталога (/api/catalog/snapshot): фильтруем у себя, сервер не спрашиваем.
+// null — снимок не загрузился, работаем постранично через /api/products
+let catalogItems = null;
+let catalogEtag = null;
+let filteredItems = [];
+let shownCount = 0;
+
+// Текст для поиска как на сервере: без регистра, «ё» = «е»
+function searchText(value) {
+  return (value || '').toLowerCase().replace(/ё/g, 'е');
+}
+
+async function loadCatalogSnapshot() {
+  try {
+    const snapshot = await API.catalogSnapshot();
+    if (catalogItems && snapshot.etag && snapshot.etag === catalogEtag) return false;
+    snapshot.items.forEach(p => {
+      p._text = searchText([p.name, p.tags, p.category, p.color].filter(Boolean).join(' '));
+    });
+    catalogItems = snapshot.items;
+    catalogEtag = snapshot.etag;
+    return true;
+  } catch (e) {
+    console.warn('Снимок каталога недоступен, грузим постранично:', e);
+    return false;
+  }
+}
+
+// Все слова запроса должны встретиться в названии, тегах, категории или цвете
+function filterCatalog(search, category) {
+  const words = searchText(search).split(/\s+/).filter(Boolean);
+  return catalogItems.filter(p =>
+    (!category || p.category === category) && words.every(w => p._text.includes(w))
+  );
+}
+
+// Отображение товаров в каталоге (append=true — дописать следующую страницу)
+function renderProducts(items, append = false) {
+  if (!append) productsEl.innerHTML = '';
   items.forEach(p => {
     const card = document.createElement('div');
     card.className = 'card';
@@ -17,7 +76,8 @@ function renderProducts(items) {
 
     const img = document.createElement('img');
     if (p.id) {
-      img.src = `/api/image/${p.id}`;
+      img.src = productImageUrl(p, { w: THUMB_WIDTH, fmt: 'webp' });
+      img.loading = 'lazy';
     } else if (p.image_url) {
       img.src = `/api/proxy?url=${encodeURIComponent(p.image_url)}`;
     }
@@ -40,7 +100,7 @@ function renderProducts(items) {
     card.addEventListener('click', () => {
       if (window.eraserMode) return; // В режиме ластика не добавляем изображения
       console.log('[catalog click]', p.name);
-      const imageUrl = p.id ? `/api/image/${p.id}` : p.image_url;
+      const imageUrl = p.id ? productCanvasImageUrl(p) : p.image_url;
       addImageToCanvas(imageUrl, p.name);
     });
     productsEl.appendChild(card);
@@ -49,7 +109,10 @@ function renderProducts(items) {
 
 // Инициализация каталога
 async function initCatalog() {
-  const cats = await API.categories();
+  await loadCatalogSnapshot();
+  const cats = catalogItems
+    ? [...new Set(catalogItems.map(p => p.category).filter(Boolean))].sort()
+    : await API.categories();
   const optAll = document.createElement('option');
   optAll.value = '';
   optAll.textContent = 'Все категории';
@@ -64,19 +127,68 @@ async function initCatalog() {
   await reloadProducts();
 }
 
-// Перезагрузка списка товаров с фильтрами
-async function reloadProducts() {
-  const params = {};
+// Текущие фильтры из полей поиска и категории
+function currentFilters() {
+  const params = { limit: PAGE_SIZE };
   const s = searchEl.value.trim();
   if (s) params.search = s;
   const c = categoryEl.value;
   if (c) params.category = c;
-  params.limit = 100;
-  const items = await API.products(params);
-  renderProducts(items);
+  return params;
+}
+
+// Перезагрузка списка товаров с фильтрами (первая страница)
+async function reloadProducts() {
+  const token = ++reloadToken;
+  if (catalogItems) {
+    filteredItems = filterCatalog(searchEl.value.trim(), categoryEl.value);
+    shownCount = Math.min(PAGE_SIZE, filteredItems.length);
+    productsEl.scrollTop = 0;
+    renderProducts(filteredItems.slice(0, shownCount));
+    return;
+  }
+  const page = await API.products(currentFilters());
+  if (token !== reloadToken) return; // пока ждали ответ, фильтры уже поменялись
+  nextCursor = page.next_cursor;
+  productsEl.scrollTop = 0;
+  renderProducts(page.items);
+}
+
+// Подгрузка следующей страницы по курсору
+async function loadMoreProducts() {
+  if (catalogItems) {
+    if (shownCount >= filteredItems.length) return;
+    const more = filteredItems.slice(shownCount, shownCount + PAGE_SIZE);
+    shownCount += more.length;
+    renderProducts(more, true);
+    return;
+  }
+  if (!nextCursor || loadingPage) return;
+  loadingPage = true;
+  const token = reloadToken;
+  try {
+    const page = await API.products({ ...currentFilters(), cursor: nextCursor });
+    if (token !== reloadToken) return;
+    nextCursor = page.next_cursor;
+    renderProducts(page.items, true);
+  } finally {
+    loadingPage = false;
+  }
 }
 
 // Обработчики поиска и фильтров
 searchEl.addEventListener('input', debounce(reloadProducts, 300));
 categoryEl.addEventListener('change', reloadProducts);
 
+// Бесконечная прокрутка: когда до конца списка осталось меньше экрана — грузим дальше
+productsEl.addEventListener('scroll', () => {
+  if (productsEl.scrollTop + productsEl.clientHeight * 2 >= productsEl.scrollHeight) {
+    loadMoreProducts();
+  }
+});
+
+// Вернулись на вкладку — перепроверяем снимок (обычно 304) и перерисовываем, если каталог изменился
+document.addEventListener('visibilitychange', async () => {
+  if (document.visibilityState !== 'visible' || !catalogItems) return;
+  if (await loadCatalogSnapshot()) reloadProducts();
+});
@@ -16,7 +16,7 @@ source .venv/bin/activate
 # Устанавливаем зависимости
 echo "Устанавливаю зависимости..."
 pip install -q --upgrade pip
-pip install -q fastapi "uvicorn[standard]" sqlmodel sqlalchemy pandas openpyxl python-dotenv python-multipart httpx
+pip install -q fastapi "uvicorn[standard]" sqlmodel sqlalchemy pandas openpyxl python-dotenv python-multipart httpx pillow
 
 # Запускаем сервер
 echo "Запускаю сервер на http://127.0.0.1:8000"
@@ -1,67 +1,498 @@
 import argparse
+import hashlib
+import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from io import BytesIO
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Union
 
-from PIL import Image
+from PIL import Image, ImageFilter
 from rembg import remove, new_session
 
 
 SUPPORTED_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+CHUNK_SIZE = 8  # картинок в одном задании воркеру
+DEFAULT_MODEL = "u2net"
+MANIFEST_NAME = ".remove_bg_manifest.json"  # лежит в папке результатов
+MANIFEST_SAVE_EVERY = 20  # сохраняем манифест не реже, чем раз в столько готовых картинок
+QUALITY_MODES = ("full", "fast")
+PREVIEW_SIZE = 640  # длинная сторона копии, на которой режим fast ищет маску
+
+
+class CutoutOptions(NamedTuple):
+	quality: str = "full"  # full — модель на оригинале; fast — на уменьшенной копии
+	preview_size: int = PREVIEW_SIZE
+	compress_level: int = 6  # zlib-уровень PNG: 1 — быстро и крупнее, 9 — медленно и мельче
+
+
+# Усиление контраста маски после увеличения: размытый край снова становится чётким,
+# полупрозрачная полоса сужается примерно вдвое
+EDGE_LUT = [min(255, max(0, (v - 64) * 2)) for v in range(256)]
+
+# Задание: (номер по порядку, исходник, файл результата).
+# Исходник — путь к файлу или id товара в базе; для товара файла результата нет (None),
+# PNG возвращается байтами и записывается в product_image главным процессом.
+# Ответ: (номер, текст ошибки или None, PNG для записи в базу или None)
+Source = Union[Path, int]
+Job = tuple[int, Source, Optional[Path]]
+JobResult = tuple[int, Optional[str], Optional[bytes]]
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]  # interior-collage, там пакет backend
+DB_COMMIT_EVERY = 20  # готовых картинок без фона на одну короткую транзакцию
+
+_session = None  # rembg-сессия текущего процесса (своя в каждом воркере)
+_options = CutoutOptions()
+_engine = None  # подключение к базе в режиме --from-db (своё в каждом воркере)
 
 
 def find_images(input_dir: Path) -> list[Path]:
 
+	# Один обход дерева; расширение сравниваем без учёта регистра (.JPG тоже подходит)
 	images: list[Path] = []
-	for ext in SUPPORTED_EXTS:
-		images.extend(sorted(input_dir.rglob(f"*{ext}")))
-	return images
+	for root, _, files in os.walk(input_dir):
+		for name in files:
+			if os.path.splitext(name)[1].lower() in SUPPORTED_EXTS:
+				images.append(Path(root) / name)
+	return sorted(images)
+
+
+def file_hash(path: Path) -> str:
+
+	digest = hashlib.sha256()
+	with path.open("rb") as f:
+		for block in iter(lambda: f.read(1024 * 1024), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+class Manifest:
+	"""Что уже обработано: исходник (путь относительно input) -> хэш, модель, результат.
+
+	Размер и mtime исходника запоминаются, чтобы не пересчитывать хэш у нетронутых файлов.
+	"""
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+		self.entries: dict[str, dict] = {}
+		if path.exists():
+			try:
+				self.entries = json.loads(path.read_text(encoding="utf-8")).get("entries", {})
+			except (OSError, ValueError):
+				print(f"Манифест повреждён, начинаем с нуля: {path}")
+
+	def source_hash(self, rel: str, src: Path) -> str:
+		st = src.stat()
+		entry = self.entries.get(rel)
+		if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+			return entry["sha256"]
+		return file_hash(src)
 
+	def is_current(self, rel: str, digest: str, model: str, quality: str, output: str, output_dir: Path) -> bool:
+		entry = self.entries.get(rel)
+		return (
+			entry is not None
+			and entry.get("sha256") == digest
+			and entry.get("model") == model
+			and entry.get("quality", "full") == quality
+			and entry.get("output") == output
+			and (output_dir / output).exists()
+		)
 
-def process_image(src_path: Path, dst_path: Path, session) -> None:
+	def record(self, rel: str, src: Path, digest: str, model: str, quality: str, output: str) -> None:
+		st = src.stat()
+		self.entries[rel] = {
+			"sha256": digest,
+			"size": st.st_size,
+			"mtime_ns": st.st_mtime_ns,
+			"model": model,
+			"quality": quality,
+			"output": output,
+		}
 
-	with Image.open(src_path) as img:
-		# rembg вернет изображение с альфой (RGBA)
-		result = remove(img, session=session)
-		# Сохраняем в PNG, чтобы точно сохранить прозрачность
+	def save(self) -> None:
+		tmp = self.path.with_suffix(".tmp")
+		tmp.write_text(json.dumps({"entries": self.entries}, ensure_ascii=False, indent=1), encoding="utf-8")
+		os.replace(tmp, self.path)
+
+
+def load_image(src_path: Path) -> Image.Image:
+
+	img = Image.open(src_path)
+	img.load()  # декодируем сразу, пока модель занята предыдущей картинкой
+	return img
+
+
+def load_product_image(product_id: int) -> Image.Image:
+
+	from sqlalchemy import text
+
+	with _engine.connect() as conn:
+		blob = conn.execute(
+			text("SELECT blob FROM product_image WHERE product_id = :id AND variant = 'original'"),
+			{"id": product_id},
+		).scalar()
+	if not blob:
+		raise ValueError("в базе нет оригинала")
+	img = Image.open(BytesIO(blob))
+	img.load()
+	return img
+
+
+def load_source(src: Source) -> Image.Image:
+
+	if isinstance(src, int):
+		return load_product_image(src)
+	return load_image(src)
+
+
+def save_png(result: Image.Image, dst_path, compress_level: int = 6) -> None:
+
+	if isinstance(dst_path, Path):
 		dst_path.parent.mkdir(parents=True, exist_ok=True)
-		result.save(dst_path, format="PNG")
+	# Сохраняем в PNG, чтобы точно сохранить прозрачность
+	result.save(dst_path, format="PNG", compress_level=compress_level)
 
 
-def run(input_dir: Path, output_dir: Path, workers: int) -> None:
+def store_result(result: Image.Image, dst_path: Optional[Path], compress_level: int) -> Optional[bytes]:
 
-	if not input_dir.exists() or not input_dir.is_dir():
-		raise SystemExit(f"Входная папка не найдена: {input_dir}")
+	if dst_path is not None:
+		save_png(result, dst_path, compress_level)
+		return None
+	buf = BytesIO()
+	save_png(result, buf, compress_level)
+	return buf.getvalue()
 
-	output_dir.mkdir(parents=True, exist_ok=True)
 
-	images = find_images(input_dir)
-	if not images:
-		print("Изображения не найдены. Поддерживаемые расширения: .png .jpg .jpeg .webp .bmp")
+def cutout_fast(img: Image.Image, session, preview_size: int) -> Image.Image:
+	"""Маска считается на уменьшенной копии, затем растягивается до оригинала и уточняется"""
+	if max(img.size) <= preview_size:
+		return remove(img, session=session)
+	small = img.convert("RGB")
+	small.thumbnail((preview_size, preview_size), Image.Resampling.BILINEAR)
+	mask = remove(small, session=session, only_mask=True)
+	# Сглаживаем ступеньки ещё на маленькой маске (дёшево), после увеличения возвращаем краю резкость
+	mask = mask.filter(ImageFilter.GaussianBlur(radius=1))
+	mask = mask.resize(img.size, Image.Resampling.BILINEAR).point(EDGE_LUT)
+	result = img.convert("RGBA")
+	result.putalpha(mask)
+	return result
+
+
+def cutout(img: Image.Image, session, options: CutoutOptions) -> Image.Image:
+
+	if options.quality == "fast":
+		return cutout_fast(img, session, options.preview_size)
+	# rembg вернет изображение с альфой (RGBA)
+	return remove(img, session=session)
+
+
+def process_image(src_path: Path, dst_path: Path, session, options: CutoutOptions = CutoutOptions()) -> None:
+
+	with load_image(src_path) as img:
+		result = cutout(img, session, options)
+	save_png(result, dst_path, options.compress_level)
+
+
+def init_worker(
+	model: str,
+	onnx_threads: Optional[int],
+	options: CutoutOptions = CutoutOptions(),
+	db_url: Optional[str] = None,
+) -> None:
+
+	global _session, _options, _engine
+	if onnx_threads:
+		# rembg берёт число потоков ONNX Runtime из OMP_NUM_THREADS
+		os.environ["OMP_NUM_THREADS"] = str(onnx_threads)
+	_session = new_session(model)
+	_options = options
+	if db_url and _engine is None:
+		from sqlalchemy import create_engine
+
+		_engine = create_engine(db_url)
+
+
+def process_chunk(jobs: list[Job]) -> list[JobResult]:
+	"""Обрабатывает пачку картинок одной сессией.
+
+	Пока модель считает текущую картинку, в соседних потоках декодируется следующая
+	и кодируется в PNG предыдущая (PIL и ONNX Runtime отпускают GIL).
+	"""
+	results: list[JobResult] = []
+	saves = []
+	with ThreadPoolExecutor(max_workers=2) as io:
+		next_image = io.submit(load_source, jobs[0][1]) if jobs else None
+		for n, (idx, src, dst) in enumerate(jobs):
+			current = next_image
+			if n + 1 < len(jobs):
+				next_image = io.submit(load_source, jobs[n + 1][1])
+			try:
+				with current.result() as img:
+					result = cutout(img, _session, _options)
+			except Exception as e:
+				results.append((idx, str(e), None))
+				continue
+			saves.append((idx, io.submit(store_result, result, dst, _options.compress_level)))
+		for idx, saved in saves:
+			try:
+				results.append((idx, None, saved.result()))
+			except Exception as e:
+				results.append((idx, str(e), None))
+	return results
+
+
+def run_chunks(
+	chunks: list[list[Job]],
+	workers: int,
+	model: str,
+	options: CutoutOptions = CutoutOptions(),
+	onnx_threads: Optional[int] = None,
+	db_url: Optional[str] = None,
+) -> Iterator[list[JobResult]]:
+	"""Отдаёт результаты пачек по мере готовности"""
+	if workers <= 1:
+		# Последовательный режим: одна сессия в текущем процессе
+		init_worker(model, onnx_threads, options, db_url)
+		for chunk in chunks:
+			yield process_chunk(chunk)
 		return
 
-	# Инициализируем сессию rembg один раз для ускорения
-	session = new_session()
+	# Ядра делим между воркерами, чтобы потоки ONNX Runtime не дрались за них
+	onnx_threads = onnx_threads or max(1, (os.cpu_count() or 1) // workers)
+	initargs = (model, onnx_threads, options, db_url)
+	with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+		futures = [pool.submit(process_chunk, chunk) for chunk in chunks]
+		for future in as_completed(futures):
+			yield future.result()
 
+
+def report_in_order(
+	jobs: list[Job],
+	chunk_results: Iterable[list[JobResult]],
+	on_success: Optional[Callable[[Job, Optional[bytes]], None]] = None,
+) -> tuple[int, int]:
+	"""Печатает прогресс строго по порядку картинок, хотя пачки завершаются вразнобой"""
+	total = len(jobs)
+	done: dict[int, tuple[Optional[str], Optional[bytes]]] = {}
+	next_idx = 1
 	processed = 0
 	failed = 0
-	for idx, src in enumerate(images, start=1):
+	for results in chunk_results:
+		for idx, error, data in results:
+			done[idx] = (error, data)
+		while next_idx in done:
+			error, data = done.pop(next_idx)
+			_, src, dst = jobs[next_idx - 1]
+			source = f"товар #{src}" if isinstance(src, int) else src
+			if error is None:
+				processed += 1
+				print(f"[{next_idx}/{total}] OK: {source} -> {dst or 'product_image (cutout)'}")
+				if on_success is not None:
+					on_success(jobs[next_idx - 1], data)
+			else:
+				failed += 1
+				print(f"[{next_idx}/{total}] FAIL: {source} | {error}")
+			next_idx += 1
+	return processed, failed
+
+
+def remove_orphans(manifest: Manifest, sources: set[str], output_dir: Path) -> int:
+	"""Удаляет результаты, исходники которых пропали из входной папки"""
+	removed = 0
+	for rel in [rel for rel in manifest.entries if rel not in sources]:
+		output = output_dir / manifest.entries.pop(rel)["output"]
+		if output.is_file():
+			output.unlink()
+			removed += 1
+			print(f"Удалён устаревший результат: {output}")
+	return removed
+
+
+def run(
+	input_dir: Path,
+	output_dir: Path,
+	workers: int,
+	chunk_size: int = CHUNK_SIZE,
+	model: str = DEFAULT_MODEL,
+	force: bool = False,
+	options: CutoutOptions = CutoutOptions(),
+	onnx_threads: Optional[int] = None,
+) -> None:
+
+	if not input_dir.exists() or not input_dir.is_dir():
+		raise SystemExit(f"Входная папка не найдена: {input_dir}")
+
+	output_dir.mkdir(parents=True, exist_ok=True)
+	manifest = Manifest(output_dir / MANIFEST_NAME)
+
+	images = find_images(input_dir)
+	sources: set[str] = set()
+	digests: dict[int, str] = {}
+	jobs: list[Job] = []
+	unchanged = 0
+	for src in images:
 		# Сохраняем структуру подпапок относительно input_dir
 		rel_path = src.relative_to(input_dir)
+		rel = rel_path.as_posix()
+		sources.add(rel)
 		# Меняем расширение на .png, чтобы сохранить альфу
-		dst = output_dir / rel_path.with_suffix(".png")
-		try:
-			process_image(src, dst, session)
-			processed += 1
-			print(f"[{idx}/{len(images)}] OK: {src} -> {dst}")
-		except Exception as e:
-			failed += 1
-			print(f"[{idx}/{len(images)}] FAIL: {src} | {e}")
+		output = rel_path.with_suffix(".png").as_posix()
+		digest = manifest.source_hash(rel, src)
+		if not force and manifest.is_current(rel, digest, model, options.quality, output, output_dir):
+			unchanged += 1
+			continue
+		jobs.append((len(jobs) + 1, src, output_dir / output))
+		digests[len(jobs)] = digest
+
+	removed = remove_orphans(manifest, sources, output_dir)
+	if not images:
+		print("Изображения не найдены. Поддерживаемые расширения: .png .jpg .jpeg .webp .bmp")
+	print(f"Найдено: {len(images)}, без изменений: {unchanged}, к обработке: {len(jobs)}")
+
+	done_since_save = 0
+
+	def on_success(job: Job, _: Optional[bytes]) -> None:
+		nonlocal done_since_save
+		idx, src, dst = job
+		rel = src.relative_to(input_dir).as_posix()
+		manifest.record(rel, src, digests[idx], model, options.quality, dst.relative_to(output_dir).as_posix())
+		done_since_save += 1
+		if done_since_save >= MANIFEST_SAVE_EVERY:
+			# Прерванный прогон продолжится с этого места
+			manifest.save()
+			done_since_save = 0
+
+	chunk_size = max(1, chunk_size)
+	chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+	try:
+		processed, failed = report_in_order(jobs, run_chunks(chunks, workers, model, options, onnx_threads), on_success)
+	finally:
+		manifest.save()
 
 	print("\nГотово.")
 	print(f"Успешно: {processed}")
+	print(f"Без изменений: {unchanged}")
+	print(f"Удалено устаревших: {removed}")
 	print(f"Ошибок:   {failed}")
 
 
+def run_from_db(
+	db_url: Optional[str],
+	workers: int,
+	chunk_size: int = CHUNK_SIZE,
+	force: bool = False,
+	model: str = DEFAULT_MODEL,
+	options: CutoutOptions = CutoutOptions(),
+	onnx_threads: Optional[int] = None,
+) -> None:
+	"""Берёт оригиналы товаров из базы и пишет результат туда же, в product_image (variant=cutout).
+
+	Обрабатываются товары, у которых картинки без фона ещё нет или она старше оригинала.
+	"""
+	if str(PROJECT_DIR) not in sys.path:
+		sys.path.insert(0, str(PROJECT_DIR))
+	from sqlmodel import Session, create_engine, text
+
+	from backend.migrations import upgrade
+	from backend.models import CUTOUT_VARIANT, save_product_image
+
+	if db_url is None:
+		from backend.db import DATABASE_URL as db_url
+
+	engine = create_engine(db_url)
+	upgrade(engine)
+	with engine.connect() as conn:
+		product_ids = [
+			row[0]
+			for row in conn.execute(
+				text(
+					"SELECT o.product_id FROM product_image AS o "
+					"LEFT JOIN product_image AS c ON c.product_id = o.product_id AND c.variant = :cutout "
+					"WHERE o.variant = 'original' AND (:force OR c.product_id IS NULL OR c.updated_at < o.updated_at) "
+					"ORDER BY o.product_id"
+				),
+				{"cutout": CUTOUT_VARIANT, "force": force},
+			)
+		]
+	print(f"Товаров к обработке: {len(product_ids)}")
+
+	jobs: list[Job] = [(n, product_id, None) for n, product_id in enumerate(product_ids, start=1)]
+	chunk_size = max(1, chunk_size)
+	chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+	ready: list[tuple[int, bytes]] = []  # (id товара, PNG), ещё не записанные в базу
+
+	def write_ready() -> None:
+		# Пишет только главный процесс и только готовые PNG: транзакция держит блокировку
+		# записи на время вставки пачки, а не на время инференции следующих картинок
+		if not ready:
+			return
+		with Session(engine) as session:
+			for product_id, data in ready:
+				save_product_image(session, product_id, data, CUTOUT_VARIANT)
+			session.commit()
+		ready.clear()
+
+	def on_success(job: Job, data: Optional[bytes]) -> None:
+		ready.append((job[1], data or b""))
+		if len(ready) >= DB_COMMIT_EVERY:
+			write_ready()
+
+	try:
+		processed, failed = report_in_order(
+			jobs, run_chunks(chunks, workers, model, options, onnx_threads, db_url), on_success
+		)
+	finally:
+		write_ready()
+
+	print("\nГотово.")
+	print(f"Успешно: {processed}")
+	print(f"Ошибок:   {failed}")
+
+
+def benchmark(input_dir: Path, model: str, limit: int, onnx_threads: Optional[int]) -> None:
+	"""Сравнивает режимы на первых `limit` картинках: время на картинку и размер PNG.
+
+	Файлы не пишутся — результат кодируется в память.
+	"""
+	decoded = []
+	for src in find_images(input_dir):
+		if len(decoded) >= limit:
+			break
+		try:
+			decoded.append(load_image(src))
+		except Exception as e:
+			print(f"Пропускаем {src}: {e}")
+	if not decoded:
+		raise SystemExit(f"Нет картинок для замера в {input_dir}")
+	init_worker(model, onnx_threads)
+	# Прогрев: первая инференция ONNX Runtime заметно медленнее остальных
+	cutout(decoded[0], _session, CutoutOptions())
+
+	modes = [
+		("full, png 6", CutoutOptions("full", PREVIEW_SIZE, 6)),
+		("full, png 1", CutoutOptions("full", PREVIEW_SIZE, 1)),
+		(f"fast {PREVIEW_SIZE}, png 1", CutoutOptions("fast", PREVIEW_SIZE, 1)),
+		("fast 320, png 1", CutoutOptions("fast", 320, 1)),
+	]
+	print(f"Картинок: {len(decoded)}, модель: {model}, потоков ONNX: {onnx_threads or 'по умолчанию'}")
+	print(f"{'режим':<22} {'мс/картинка':>12} {'КБ/картинка':>12}")
+	baseline = None
+	for label, options in modes:
+		started = time.perf_counter()
+		size = 0
+		for img in decoded:
+			buf = BytesIO()
+			save_png(cutout(img, _session, options), buf, options.compress_level)
+			size += buf.tell()
+		per_image = (time.perf_counter() - started) * 1000 / len(decoded)
+		baseline = baseline or per_image
+		print(f"{label:<22} {per_image:>12.1f} {size / len(decoded) / 1024:>12.1f}  x{baseline / per_image:.1f}")
+
+
 def parse_args(argv: list[str]) -> argparse.Namespace:
 
 	script_dir = Path(__file__).resolve().parent
@@ -91,7 +522,68 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
 		"-w",
 		type=int,
 		default=1,
-		help="Зарезервировано. Сейчас обрабатывается последовательно",
+		help="Число процессов; у каждого своя сессия rembg и своя доля ядер CPU",
+	)
+	parser.add_argument(
+		"--model",
+		"-m",
+		default=DEFAULT_MODEL,
+		help="Модель rembg (u2net, u2netp, isnet-general-use, ...); при смене модели всё пересчитывается",
+	)
+	parser.add_argument(
+		"--force",
+		action="store_true",
+		help="Обработать все картинки заново, не глядя на манифест",
+	)
+	parser.add_argument(
+		"--chunk-size",
+		type=int,
+		default=CHUNK_SIZE,
+		help="Сколько картинок отдавать воркеру за одно задание",
+	)
+	parser.add_argument(
+		"--quality",
+		"-q",
+		choices=QUALITY_MODES,
+		default="full",
+		help="full — модель на оригинале; fast — маска на уменьшенной копии (для превью в редакторе)",
+	)
+	parser.add_argument(
+		"--preview-size",
+		type=int,
+		default=PREVIEW_SIZE,
+		help="Длинная сторона копии для режима fast",
+	)
+	parser.add_argument(
+		"--onnx-threads",
+		type=int,
+		default=None,
+		help="Потоков ONNX Runtime на процесс (по умолчанию ядра делятся между воркерами)",
+	)
+	parser.add_argument(
+		"--compress-level",
+		type=int,
+		choices=range(0, 10),
+		default=None,
+		metavar="0-9",
+		help="Уровень сжатия PNG (по умолчанию 6 для full и 1 для fast)",
+	)
+	parser.add_argument(
+		"--from-db",
+		action="store_true",
+		help="Брать оригиналы из базы каталога и сохранять результат туда же (variant=cutout)",
+	)
+	parser.add_argument(
+		"--db",
+		default=None,
+		help="URL базы для --from-db, например sqlite:///shared/catalog.db (по умолчанию DATABASE_URL приложения)",
+	)
+	parser.add_argument(
+		"--benchmark",
+		type=int,
+		default=0,
+		metavar="N",
+		help="Не обрабатывать папку, а сравнить режимы на первых N картинках",
 	)
 	return parser.parse_args(argv)
 
@@ -99,8 +591,35 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
 def main(argv: list[str]) -> int:
 
 	args = parse_args(argv)
+	compress_level = args.compress_level
+	if compress_level is None:
+		compress_level = 1 if args.quality == "fast" else 6
+	options = CutoutOptions(args.quality, max(32, args.preview_size), compress_level)
 	try:
-		run(args.input, args.output, args.workers)
+		if args.benchmark:
+			benchmark(args.input, args.model, args.benchmark, args.onnx_threads)
+			return 0
+		if args.from_db:
+			run_from_db(
+				args.db,
+				args.workers,
+				args.chunk_size,
+				args.force,
+				args.model,
+				options,
+				args.onnx_threads,
+			)
+			return 0
+		run(
+			args.input,
+			args.output,
+			args.workers,
+			args.chunk_size,
+			args.model,
+			args.force,
+			options,
+			args.onnx_threads,
+		)
 	except SystemExit as e:
 		print(e)
 		return 1